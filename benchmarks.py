@@ -0,0 +1,102 @@
+"""
+Micro-benchmarks for the compiler.
+Usage: python benchmarks.py [benchmark ...]
+Run without arguments to run every benchmark.
+"""
+import os
+import sys
+import time
+import timeit
+
+from codegen import generate_code
+from fsm import FSM
+from lexer import Lexer
+from rdp import RDP
+from token_stream import TokenStream
+
+def bench_fsm(number=20):
+    """Print the cost per token of the identifier, integer, real, and product FSMs"""
+    words = ['variable_1', 'abc123', 'x', '1849375932', '7', '3.14', '22.5', '26.', '.009', 'max']
+    words = words * 1000
+    fsm = FSM()
+    print(f"{'FSM':15}{'ns/token':>10}")
+    for name, check in [('is_identifier', fsm.is_identifier),
+                        ('is_integer', fsm.is_integer),
+                        ('is_real', fsm.is_real),
+                        ('classify', fsm.classify)]:
+        seconds = min(timeit.repeat(lambda: [check(w) for w in words], number=number, repeat=3))
+        print(f"{name:15}{seconds / number / len(words) * 1e9:>10.0f}")
+
+def synthetic_program(megabytes):
+    """Return a synthetic source code of about megabytes MB made of the sample programs"""
+    sample = ''
+    for filename in sorted(os.listdir('RAT24S_programs')):
+        with open(os.path.join('RAT24S_programs', filename), encoding='utf-8-sig') as source_file:
+            sample += source_file.read() + '\n'
+    return sample * (megabytes * 2**20 // len(sample) + 1)
+
+def bench_parallel(megabytes=100, workers=(1, 2, 4, 8)):
+    """Print the time to tokenize a synthetic program with each number of worker processes"""
+    source_code = synthetic_program(megabytes)
+    print(f"{len(source_code) / 2**20:.0f} MB, {os.cpu_count()} CPUs")
+    print(f"{'Workers':15}{'Seconds':>10}{'Speedup':>10}")
+    serial = None
+    for count in workers:
+        start = time.perf_counter()
+        TokenStream.from_source(source_code, workers=count)
+        seconds = time.perf_counter() - start
+        serial = serial or seconds
+        print(f"{count:<15}{seconds:>10.2f}{serial / seconds:>10.2f}")
+
+def bench_lexer(megabytes=5, scanners=('regex', 'split')):
+    """Print the time to tokenize a synthetic program with each scanner"""
+    source_code = synthetic_program(megabytes)
+    print(f"{'Scanner':15}{'Seconds':>10}{'ns/char':>10}")
+    for scanner in scanners:
+        start = time.perf_counter()
+        Lexer(source_code, scanner=scanner)
+        seconds = time.perf_counter() - start
+        print(f"{scanner:15}{seconds:>10.2f}{seconds / len(source_code) * 1e9:>10.0f}")
+
+def synthetic_statements(count):
+    """Return a valid program with a flat list of count statements"""
+    kinds = ['a = b + c * 2 ;', 'print ( a - 1 ) ;', 'if ( a < b ) c = a ; endif',
+             'while ( a > 0 ) a = a - 1 ; endwhile', 'scan ( a , b ) ;']
+    statements = [kinds[idx % len(kinds)] for idx in range(count)]
+    return '$ $ integer a, b, c; $\n' + '\n'.join(statements) + '\n$'
+
+def bench_parser(counts=(1000, 10000, 100000)):
+    """Print the time the recursive descent parser takes to parse programs with more and more statements"""
+    print(f"{'Statements':>12}{'Seconds':>10}{'us/stmt':>10}")
+    for count in counts:
+        lexer = Lexer(synthetic_statements(count))
+        start = time.perf_counter()
+        RDP(lexer).rat24s()
+        seconds = time.perf_counter() - start
+        print(f"{count:>12}{seconds:>10.2f}{seconds / count * 1e6:>10.1f}")
+
+def bench_codegen(counts=(1000, 10000, 100000)):
+    """Print the time to parse programs into syntax trees and to generate their code, separately"""
+    print(f"{'Statements':>12}{'Parse s':>10}{'Codegen s':>11}{'Instructions':>14}")
+    for count in counts:
+        parser = RDP(Lexer(synthetic_statements(count)))
+        start = time.perf_counter()
+        parser.rat24s()
+        parse_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        instructions = generate_code(parser.nodes)
+        codegen_seconds = time.perf_counter() - start
+        print(f"{count:>12}{parse_seconds:>10.2f}{codegen_seconds:>11.2f}{len(instructions):>14}")
+
+benchmarks = {
+    'fsm': bench_fsm,
+    'lexer': bench_lexer,
+    'parser': bench_parser,
+    'codegen': bench_codegen,
+    'parallel': bench_parallel,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        benchmarks[name]()
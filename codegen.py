@@ -0,0 +1,289 @@
+"""Code generation from the syntax tree built by the recursive descent parser"""
+from syntax_tree import (Assign, BinaryOp, Boolean, Call, Compound, Condition,
+                         Function, Identifier, If, Incomplete, Integer, Negate,
+                         Parenthesized, Print, Program, Real, Return, Scan, While)
+
+# Instruction of each relational and arithmetic operator
+RELOP_INSTRUCTIONS = {'<': 'LES', '>': 'GRT', '==': 'EQU', '!=': 'NEQ', '=>': 'GEQ', '<=': 'LEQ'}
+OPERATOR_INSTRUCTIONS = {'+': 'A', '-': 'S', '*': 'M', '/': 'D'}
+# Operators of <Expression_prime> and of <Term_prime>
+ADDITIVE_OPERATORS = ('+', '-')
+MULTIPLICATIVE_OPERATORS = ('*', '/')
+
+def last_operand(node):
+  """Return the node of the last primary of the expression node"""
+  while True:
+    node_type = type(node)
+    if node_type is Negate:
+      node = node.operand
+    elif node_type is BinaryOp:
+      node = node.right
+    else:
+      return node
+
+class CodeGenerator:
+  """
+  Generates assembly instructions from syntax trees, in the same order as
+  the parser generated them while parsing:
+  1. Expressions are generated as <Expression_prime> and <Term_prime>
+     were parsed. An identifier is pushed when it is the last token before
+     an operator, and when it is the last token of the right operand (of
+     the whole <Term_prime> for * and /). The A of + comes right after the
+     +, then is swapped with the instruction after the right operand, and
+     the S of each - comes once the whole <Expression_prime> is generated.
+     In print statements, identifiers are pushed where they are instead.
+  2. Conditions push their expressions if they end with an identifier,
+     and swap the last two instructions before the JUMP0.
+  3. The JUMP0 of a condition is only patched by the end of a while loop,
+     which patches the last JUMP0 that is not patched yet, and jumps back
+     to the last LABEL.
+  Incomplete nodes generate the instructions of what was parsed of them,
+  up to where they failed to parse.
+  Nodes without nested statements or expressions are generated by a
+  method that appends their instructions. The other nodes are generated
+  by a generator method that yields each node they contain when its
+  instructions come. Like RDP.run_steps, the generators are kept on an
+  explicit stack so deeply nested programs do not use the Python call
+  stack. Each method gets the node, and whether it parsed completely.
+  """
+  def __init__(self):
+    self.instructions = []
+    # True while generating the expression of a print statement
+    self.in_print = False
+    # Method generating each type of node
+    self.node_steps = {
+      Program: self.program_steps,
+      Function: self.function_steps,
+      Compound: self.compound_steps,
+      Assign: self.assign_steps,
+      If: self.If_steps,
+      Return: self.Return_steps,
+      Print: self.Print_steps,
+      Scan: self.scan,
+      While: self.While_steps,
+      Condition: self.condition_steps,
+      BinaryOp: self.binary_op_steps,
+      Negate: self.negate_steps,
+      Parenthesized: self.parenthesized_steps,
+      Identifier: self.identifier,
+      Integer: self.integer,
+      Real: self.real,
+      Boolean: self.boolean,
+      Call: self.call,
+    }
+
+  def steps(self, node):
+    """Return the generator of node, or None if its instructions were appended"""
+    if type(node) is Incomplete:
+      return self.node_steps[type(node.node)](node.node, False)
+    return self.node_steps[type(node)](node, True)
+
+  def generate(self, node):
+    """Append the instructions of node and its nested nodes"""
+    steps = self.steps(node)
+    if steps is None:
+      return
+    stack = [steps]
+    while stack:
+      try:
+        nested_node = next(stack[-1])
+      except StopIteration:
+        stack.pop()
+      else:
+        nested_steps = self.steps(nested_node)
+        if nested_steps is not None:
+          stack.append(nested_steps)
+
+  def emit(self, instruction):
+    """Append instruction"""
+    self.instructions.append(instruction)
+
+  def swap_last_two_instructions(self):
+    """Swap the last two instructions"""
+    instructions = self.instructions
+    if len(instructions) < 2:
+      raise ValueError("Cannot swap instructions because there less than 2")
+    instructions[-1], instructions[-2] = instructions[-2], instructions[-1]
+
+  def push_identifier(self, node):
+    """
+    Append the instruction pushing the Identifier node, or its error if it
+    was not declared. Only identifiers the parser did not look up, when it
+    ignores the symbol table, have neither.
+    """
+    if node.error is not None:
+      self.emit(node.error)
+    elif node.address is not None:
+      self.emit(f"PUSHM {node.address}")
+
+  def push_last_operand(self, node):
+    """Push the last primary of the expression node if it is an identifier, outside of print statements"""
+    if self.in_print:
+      return
+    node = last_operand(node)
+    if type(node) is Identifier:
+      self.push_identifier(node)
+
+  def pop_identifier(self, node):
+    """Append the instruction storing the top of the stack in the Identifier node"""
+    if node.error is not None:
+      self.emit(node.error)
+    elif node.address is not None:
+      self.emit(f"POPM {node.address}")
+
+  def program_steps(self, node, complete):
+    for function in node.functions:
+      yield function
+    for statement in node.statements:
+      yield statement
+
+  def function_steps(self, node, complete):
+    for statement in node.body:
+      yield statement
+
+  def compound_steps(self, node, complete):
+    for statement in node.statements:
+      yield statement
+
+  def assign_steps(self, node, complete):
+    if node.value is not None:
+      yield node.value
+    if complete:
+      self.pop_identifier(node.target)
+
+  def If_steps(self, node, complete):
+    for statement in (node.condition, node.then, node.otherwise):
+      if statement is not None:
+        yield statement
+
+  def Return_steps(self, node, complete):
+    if node.value is not None:
+      yield node.value
+
+  def Print_steps(self, node, complete):
+    if node.value is not None:
+      self.in_print = True
+      yield node.value
+      self.in_print = False
+    if complete:
+      self.emit('SOUT')
+
+  def scan(self, node, complete):
+    for target in node.targets:
+      if not complete and target.error is not None:
+        # The identifier the list of identifiers stopped at
+        self.emit(target.error)
+        return
+      self.emit('SIN')
+      self.pop_identifier(target)
+
+  def While_steps(self, node, complete):
+    self.emit('LABEL')
+    if node.condition is not None:
+      yield node.condition
+    if node.body is not None:
+      yield node.body
+    if not complete:
+      return
+    instructions = self.instructions
+    # Jump back to the last label
+    label_line_num = len(instructions)
+    while instructions[label_line_num - 1] != 'LABEL':
+      label_line_num -= 1
+    self.emit(f"JUMP {label_line_num}")
+    # Make the last JUMP0 that is not patched yet jump to the next line
+    for idx in range(len(instructions) - 1, -1, -1):
+      if instructions[idx] == 'JUMP0 UNDEFINED':
+        instructions[idx] = f"JUMP0 {len(instructions) + 1}"
+        break
+
+  def condition_steps(self, node, complete):
+    for expression in (node.left, node.right):
+      if expression is None:
+        return
+      yield expression
+      if type(expression) is Incomplete:
+        return
+      last = last_operand(expression)
+      if type(last) is Identifier:
+        self.push_identifier(last)
+      if expression is node.left:
+        if node.operator is None:
+          return
+        self.emit(RELOP_INSTRUCTIONS[node.operator])
+    if complete:
+      self.swap_last_two_instructions()
+      self.emit('JUMP0 UNDEFINED')
+
+  def binary_op_steps(self, node, complete):
+    # Operands and operators of the whole <Expression_prime> or <Term_prime>
+    # the operator is in. Only the last operand can be None or Incomplete.
+    chain_operators = ADDITIVE_OPERATORS if node.operator in ADDITIVE_OPERATORS else MULTIPLICATIVE_OPERATORS
+    operands = []
+    operators = []
+    while type(node) is BinaryOp and node.operator in chain_operators:
+      operands.append(node.right)
+      operators.append(node.operator)
+      node = node.left
+    operands.append(node)
+    operands.reverse()
+    operators.reverse()
+    if operands[0] is not None:
+      yield operands[0]
+    subtract_count = 0
+    for idx, operator in enumerate(operators):
+      self.push_last_operand(operands[idx])
+      if operator == '+':
+        self.emit('A')
+      operand = operands[idx + 1]
+      if operand is None:
+        return
+      yield operand
+      if type(operand) is Incomplete:
+        return
+      if operator == '+':
+        self.push_last_operand(operand)
+        self.swap_last_two_instructions()
+      elif operator == '-':
+        self.push_last_operand(operand)
+        subtract_count += 1
+    for _ in range(subtract_count):
+      self.emit('S')
+    if chain_operators is MULTIPLICATIVE_OPERATORS:
+      for operator in reversed(operators):
+        self.push_last_operand(operands[-1])
+        self.emit(OPERATOR_INSTRUCTIONS[operator])
+
+  def negate_steps(self, node, complete):
+    if node.operand is not None:
+      yield node.operand
+
+  def parenthesized_steps(self, node, complete):
+    yield node.value
+
+  def identifier(self, node, complete):
+    # Identifiers are pushed by the expressions they are in, with
+    # push_last_operand, except in print statements
+    if self.in_print:
+      self.push_identifier(node)
+
+  def integer(self, node, complete):
+    self.emit(f"PUSHI {node.value}")
+
+  def real(self, node, complete):
+    # There are no instructions for real numbers
+    pass
+
+  def boolean(self, node, complete):
+    self.emit('PUSHI 1' if node.value else 'PUSHI 0')
+
+  def call(self, node, complete):
+    # Functions are not called by the generated code
+    pass
+
+def generate_code(nodes):
+  """Return the assembly instructions of the syntax tree nodes, in order"""
+  generator = CodeGenerator()
+  for node in nodes:
+    generator.generate(node)
+  return generator.instructions
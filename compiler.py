@@ -1,32 +1,66 @@
 import utils
 from lexer import Lexer
 from rdp import RDP
+from token_cache import TokenCache
+from trace_writer import StructuredTraceWriter
 
 def main(path, print_tokens, tokens_filename, print_prods, out_filename,
-         sym_table_filename, asm_filename, print_arg_help, *, supress_print=False):
-    # Read source code
-    with open(path, mode='r', encoding='utf-8-sig') as source_file:
-        source_code = source_file.read()
-
+         sym_table_filename, asm_filename, print_arg_help, cache_dir=None, tokens_format='text',
+         prods_format='text', trace_kinds=None, trace_nonterminals=None, trace_sample=1, *,
+         supress_print=False):
     # Parse tokens using lexer
-    lexical_analyzer = Lexer(source_code)
+    if print_tokens:
+        # Printing tokens needs the whole source code
+        with open(path, mode='r', encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+    if cache_dir:
+        # Load the tokens from the token cache if the source file has not
+        # changed since it was last compiled
+        lexical_analyzer = TokenCache(cache_dir).lexer(path)
+    elif print_tokens:
+        lexical_analyzer = Lexer(source_code)
+    elif tokens_filename:
+        # Stream the source file in chunks instead of reading it all at once
+        lexical_analyzer = Lexer.from_file(path)
+    else:
+        # Only tokenize as far as the parser reads
+        lexical_analyzer = Lexer.from_file(path, lazy=True)
 
     # Save tokens to file if user used --save-tokens arg
     if tokens_filename:
-        lexical_analyzer.save_tokens(tokens_filename)
+        lexical_analyzer.save_tokens(tokens_filename, tokens_format)
 
     # Print source code and tokens if user used --print-tokens arg
     if print_tokens:
         utils.print_source_code(source_code)
         lexical_analyzer.print_tokens()
 
-    # Initialize recursive descent parser
+    # Save the productions as a structured trace if the user used
+    # --save-productions-format jsonl or bin
+    trace = None
+    if out_filename and prods_format != 'text':
+        trace = StructuredTraceWriter(out_filename, prods_format, kinds=trace_kinds,
+                                      nonterminals=trace_nonterminals, sample=trace_sample,
+                                      print_to_console=print_prods)
+
+    # Initialize recursive descent parser. It recovers from syntax errors
+    # so every error of the program is reported at once.
     rdp_parser = RDP(lexical_analyzer, print_to_console=print_prods,
-                     out_filename=out_filename)
+                     out_filename=out_filename, trace=trace, recover=True)
 
     # Check if source code is valid RAT24S program
     is_valid_program = rdp_parser.rat24s()
+    rdp_parser.close()
+    lexical_analyzer.close()
     if not supress_print:
+        # Print lexer errors such as unterminated comments
+        for error in lexical_analyzer.errors:
+            print(error)
+        # Print the syntax and semantic errors found by the parser, unless
+        # they were already printed with the productions
+        if not print_prods:
+            for diagnostic in rdp_parser.diagnostics:
+                print(diagnostic)
         if is_valid_program:
             print("Valid RAT24S program")
         else:
@@ -1,4 +1,86 @@
 import string
+from array import array
+
+# Column used in a character class table for symbols not in the alphabet
+NOT_IN_ALPHABET = 255
+
+def compile_fsm(transition_table, alphabet, accepted_states):
+    """
+    Compile a finite-state machine into flat tables that can be walked by
+    FSM.run_fsm without allocating anything.
+    Returns a tuple with:
+    1. char_class: a 128-entry array mapping each ASCII code to its column
+       in the transition table, or NOT_IN_ALPHABET
+    2. transitions: the transition table flattened row by row
+    3. column count: the number of columns in each row of transitions
+    4. accepting: a bytes object where accepting[state] is 1 for accepted states
+    """
+    char_class = array('B', [NOT_IN_ALPHABET] * 128)
+    for symbol, col in alphabet.items():
+        char_class[ord(symbol)] = col
+
+    col_count = len(transition_table[0])
+    transitions = array('B', [state for row in transition_table for state in row])
+    accepting = bytes(1 if state in accepted_states else 0 for state in range(len(transition_table)))
+    return char_class, transitions, col_count, accepting
+
+def compile_product_fsm(fsms, token_types):
+    """
+    Combine compiled finite-state machines into one finite-state machine
+    using the product construction. Each state of the product is a tuple
+    with the state of every finite-state machine, where None means that
+    finite-state machine has rejected the string.
+    Returns a tuple with the char_class, transitions, and column count of
+    the product (same layout as compile_fsm), and a tuple mapping each
+    product state to the token type of the first finite-state machine that
+    accepts in it, or 'illegal'.
+    """
+    # Symbols with the same column in every finite-state machine share a
+    # column in the product
+    char_class = array('B', [NOT_IN_ALPHABET] * 128)
+    columns = []
+    for code in range(128):
+        signature = tuple(fsm[0][code] for fsm in fsms)
+        if all(col == NOT_IN_ALPHABET for col in signature):
+            continue
+        if signature not in columns:
+            columns.append(signature)
+        char_class[code] = columns.index(signature)
+
+    # Build the reachable product states starting from the start state
+    start = tuple(0 for fsm in fsms)
+    states = {start: 0}
+    rows = []
+    queue = [start]
+    while queue:
+        product_state = queue.pop(0)
+        row = []
+        for signature in columns:
+            next_state = []
+            for state, col, (_, transitions, col_count, _) in zip(product_state, signature, fsms):
+                if state is None or col == NOT_IN_ALPHABET:
+                    next_state.append(None)
+                else:
+                    next_state.append(transitions[state * col_count + col])
+            next_state = tuple(next_state)
+            if next_state not in states:
+                states[next_state] = len(states)
+                queue.append(next_state)
+            row.append(states[next_state])
+        rows.append(row)
+
+    # Token type of each product state
+    state_types = []
+    for product_state in states:
+        state_type = 'illegal'
+        for state, fsm, token_type in zip(product_state, fsms, token_types):
+            if state is not None and fsm[3][state]:
+                state_type = token_type
+                break
+        state_types.append(state_type)
+
+    transitions = array('B', [state for row in rows for state in row])
+    return char_class, transitions, len(columns), tuple(state_types)
 
 class FSM:
     """
@@ -9,96 +91,112 @@ class FSM:
     2. alphabet: a dictionary that maps all possible symbols to their column
        in the transition table
     3. accepted states: a set with all accepted states
+    The finite-state machines are compiled once, when the class is defined,
+    with compile_fsm.
     """
 
-    def run_fsm(self, transition_table, alphabet, accepted_states, w):
+    # Transition table for real number. RE: d+.d+
+    real_tt = [
+        [1, 4],
+        [1, 2],
+        [3, 4],
+        [3, 4],
+        [4, 4]
+    ]
+    # Alphabet map for real numbers. Maps symbols to column in
+    # transition table
+    # digits are all col 0; '.' is col 1
+    real_alpha = {digit: 0 for digit in string.digits}
+    real_alpha['.'] = 1
+    # Accepted states for real numbers
+    real_accepted = set([3])
+
+    # Transition table for identifier. RE: l(l|d|_)*
+    identifier_tt = [
+        [1, 5, 5],
+        [2, 3, 4],
+        [2, 3, 4],
+        [2, 3, 4],
+        [2, 3, 4],
+        [5, 5, 5],
+    ]
+    # Alphabet map for identifiers. Maps symbols to column in
+    # transition table
+    # letters are col 0, digits are col 1, underscore is col 2
+    identifier_alpha = {char: 0 for char in string.ascii_letters}
+    identifier_alpha.update({digit: 1 for digit in string.digits})
+    identifier_alpha['_'] = 2
+    # Accepted states for identifiers
+    identifier_accepted = set([1, 2, 3, 4])
+
+    # Transition table for an integer. RE: d+
+    integer_tt = [
+        [1],
+        [1]
+    ]
+    # Alphabet mapping digit symbols to their column in the transition table
+    integer_alpha = {digit: 0 for digit in string.digits}
+    # Set of accepted states in transition table
+    integer_accepted = set([1])
+
+    # Compiled finite-state machines
+    real_fsm = compile_fsm(real_tt, real_alpha, real_accepted)
+    identifier_fsm = compile_fsm(identifier_tt, identifier_alpha, identifier_accepted)
+    integer_fsm = compile_fsm(integer_tt, integer_alpha, integer_accepted)
+    # Product of the identifier, integer, and real finite-state machines.
+    # Classifies a string in one walk, checking in the same order as the lexer
+    token_fsm = compile_product_fsm([identifier_fsm, integer_fsm, real_fsm],
+                                    ['identifier', 'integer', 'real'])
+
+    def run_fsm(self, fsm, w):
         """
-        Run the finite-state machine on the string w using the passed in
-        transition table, alphabet, and accepted states.
+        Run the compiled finite-state machine fsm on the string w.
         Return True if finite-state machine ends in an accepted state, False
         otherwise. Return False if w contains a symbol not found in alphabet.
         Note: No need to modify this method when adding new patterns.
         """
+        char_class, transitions, col_count, accepting = fsm
         state = 0
-        for i in range(len(w)):
-            curr_symbol = w[i]
+        for curr_symbol in w:
+            code = ord(curr_symbol)
             # Return False if current symbol not in alphabet
-            if curr_symbol not in alphabet:
+            if code >= 128:
+                return False
+            col = char_class[code]
+            if col == NOT_IN_ALPHABET:
                 return False
             # Transition to next state
-            col = alphabet[curr_symbol]
-            state = transition_table[state][col]
-        if state in accepted_states:
-            return True
-        else:
-            return False
+            state = transitions[state * col_count + col]
+        return accepting[state] == 1
 
     def is_real(self, w):
         """Return True if the string w is a real number, False otherwise"""
-        # Transition table for real number. RE: d+.d+
-        real_tt = [
-            [1, 4],
-            [1, 2],
-            [3, 4],
-            [3, 4],
-            [4, 4]
-        ]
-
-        # Alphabet map for real numbers. Maps symbols to column in
-        # transition table
-        # digits are all col 0; '.' is col 1
-        real_alpha = {'0': 0, '1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0,
-                      '7': 0, '8': 0, '9': 0, '.': 1}
-
-        # Accepted states for real numbers
-        real_accepted = set([3])
-
-        # Run FSM on string w and return result
-        is_accepted = self.run_fsm(real_tt, real_alpha, real_accepted, w)
-        return is_accepted
+        return self.run_fsm(self.real_fsm, w)
 
     def is_identifier(self, w):
         """Return True if the string w is an identifier, False otherwise"""
-        # Transition table for identifier. RE: l(l|d|_)*
-        identifier_tt = [
-            [1, 5, 5],
-            [2, 3, 4],
-            [2, 3, 4],
-            [2, 3, 4],
-            [2, 3, 4],
-            [5, 5, 5],
-        ]
-
-        # Alphabet map for identifiers. Maps symbols to column in
-        # transition table
-        # letters are col 0, digits are col 1, underscore is col 2
-        identifier_alpha = {char: 0 for char in string.ascii_uppercase}
-        identifier_alpha.update({char: 0 for char in string.ascii_lowercase})
-        identifier_alpha.update({digit: 1 for digit in string.digits})
-        identifier_alpha['_'] = 2
-
-        # Accepted states for real numbers
-        identifier_accepted = set([1,2,3,4])
-
-        # Run FSM on string w and return result
-        is_accepted = self.run_fsm(identifier_tt, identifier_alpha, identifier_accepted, w)
-        return is_accepted
+        return self.run_fsm(self.identifier_fsm, w)
 
     def is_integer(self, w):
         """Return True if string w is an integer, False otherwise"""
-        # Transition table for an integer. RE: d+
-        integer_tt = [
-            [1],
-            [1]
-        ]
-
-        # Alphabet mapping digit symbols to their column in the transition table
-        integer_alpha ={'0': 0, '1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0,
-                      '7': 0, '8': 0, '9': 0}
-
-        # Set of accepted states in transition table
-        integer_accepted = set([1])
-
-        # Run finite-state machine to check if string w is an integer
-        is_accepted = self.run_fsm(integer_tt, integer_alpha, integer_accepted, w)
-        return is_accepted
+        return self.run_fsm(self.integer_fsm, w)
+
+    def classify(self, w):
+        """
+        Return the token type of the string w: 'identifier', 'integer', or
+        'real', or 'illegal' if w is none of them.
+        w is only walked once by the product finite-state machine.
+        Used by the 'split' scanner. The default regex scanner classifies
+        tokens with its master pattern instead (see Lexer.re_master).
+        """
+        char_class, transitions, col_count, state_types = self.token_fsm
+        state = 0
+        for curr_symbol in w:
+            code = ord(curr_symbol)
+            if code >= 128:
+                return 'illegal'
+            col = char_class[code]
+            if col == NOT_IN_ALPHABET:
+                return 'illegal'
+            state = transitions[state * col_count + col]
+        return state_types[state]
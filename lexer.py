@@ -1,7 +1,83 @@
+import bisect
+import codecs
+import mmap
+import os
 import re
 
 from fsm import FSM
-from parse_token import Token
+from parse_token import MappedToken, Token
+
+KEYWORDS = ('function', 'integer', 'boolean', 'real', 'if', 'else', 'endif', 'while',
+            'endwhile', 'return', 'scan', 'print', 'true', 'false')
+
+def build_master_pattern(token_char, comment_groups):
+    """
+    Return a master pattern with one named group per token class.
+    token_char is the pattern for a character that can be part of a
+    potential token and comment_groups are the patterns matching comments.
+    """
+    keywords = '|'.join(KEYWORDS)
+    return '|'.join(comment_groups + [
+        r'(?P<whitespace>\s+)',
+        r'(?P<operator>==|!=|<=|=>|[+\-*/<>=])',
+        r'(?P<separator>[(){},;$])',
+        r'(?P<keyword>(?:' + keywords + ')(?!' + token_char + '))',
+        r'(?P<identifier>[A-Za-z][A-Za-z0-9_]*(?!' + token_char + '))',
+        r'(?P<real>[0-9]+\.[0-9]+(?!' + token_char + '))',
+        r'(?P<integer>[0-9]+(?!' + token_char + '))',
+        r'(?P<illegal>' + token_char + '+)',
+    ])
+
+class TokenWindow:
+    """
+    Sequence of tokens that are pulled from a token generator on demand.
+    Tokens are indexed by their position in the whole token stream. If
+    window is set, only the last window tokens before the furthest token
+    read so far are kept; older tokens are dropped and can no longer be
+    indexed.
+    """
+
+    def __init__(self, token_source, window=None):
+        self.token_source = token_source
+        self.window = window
+        self.buffer = []
+        self.base = 0  # Position of buffer[0] in the token stream
+        self.exhausted = False
+
+    def fill(self, idx):
+        """
+        Read tokens from the token generator until the token at idx is in
+        the buffer. Return False if the token stream ends before idx.
+        """
+        while idx >= self.base + len(self.buffer):
+            if self.exhausted:
+                return False
+            token = next(self.token_source, None)
+            if token is None:
+                self.exhausted = True
+                return False
+            self.buffer.append(token)
+        # Drop tokens that are outside the window, in batches of window tokens
+        if self.window is not None and len(self.buffer) > 2 * self.window:
+            drop = len(self.buffer) - self.window
+            del self.buffer[:drop]
+            self.base += drop
+        return True
+
+    def __getitem__(self, idx):
+        buffer_idx = idx - self.base
+        if 0 <= buffer_idx < len(self.buffer):
+            return self.buffer[buffer_idx]
+        if idx < 0:
+            # Negative indexes count from the end of the token stream
+            while self.fill(self.base + len(self.buffer)):
+                pass
+            idx += self.base + len(self.buffer)
+        if not self.fill(idx):
+            raise IndexError("token index out of range")
+        if idx < self.base:
+            raise IndexError(f"Token {idx} is no longer in the lexer's window of {self.window} tokens")
+        return self.buffer[idx - self.base]
 
 class Lexer:
     """
@@ -52,12 +128,63 @@ class Lexer:
         #---------- Operator ----------#
     }
 
-    def __init__(self, sourceCode):
+    # Characters that can be part of a potential token, ie. anything that is
+    # not whitespace, an operator, a separator, or the start of a comment.
+    # '!' only ends a potential token when it starts the != operator
+    re_token_char = r'(?:[^\s=<>+\-*/(){},;$!\[]|!(?!=)|\[(?!\*))'
+    # Comments and unterminated comments, which run to the end of the source code
+    re_comment = r'(?P<comment>\[\*[\s\S]*?\*\])'
+    re_unterminated_comment = r'(?P<unterminated_comment>\[\*[\s\S]*)'
+    # Master pattern used by the regex scanner. Each named group is a token
+    # class. Groups are tried in order so keywords are matched before
+    # identifiers and reals before integers.
+    # The regex scanner does not use FSM.classify: the master pattern already
+    # classifies each token while matching it, in one pass in C, so walking
+    # the FSM again in Python for every word only adds time (about 15% more
+    # on a 1.4 MB source). FSM.classify is the classification path of the
+    # 'split' scanner, which the tests compare token by token with the regex
+    # scanner, so the two definitions of the token classes stay in step.
+    re_master = re.compile(build_master_pattern(re_token_char, [re_comment, re_unterminated_comment]))
+    # Same pattern over bytes, used to scan memory-mapped source files
+    re_master_bytes = re.compile(re_master.pattern.encode())
+    # Master pattern used by the streaming scanner. It only ever looks one
+    # character past the end of a match, so a match that ends before the end
+    # of a chunk is final. '[*' opens a comment, which is skipped separately
+    # since it can span any number of chunks.
+    re_stream = re.compile(build_master_pattern(re_token_char, [r'(?P<open_comment>\[\*)']))
+    # Number of characters read from the source file at a time when streaming
+    stream_chunk_size = 1 << 16
+    # Version of the tokens returned by the lexer, used to invalidate cached
+    # tokens. Increase it whenever the lexer returns different tokens.
+    version = 1
+
+    def __init__(self, sourceCode, *, scanner='regex', lazy=False, window=None, workers=None):
+        """
+        scanner is 'regex' to tokenize with a single pass of the master
+        pattern, 'split' to use the original re.split and FSM scanner, or
+        'parallel' to tokenize chunks of the source code with the master
+        pattern in workers processes (one per CPU if workers is None).
+        If lazy is True, the source code is tokenized on demand with the
+        regex scanner as tokens are read, and tokens is a TokenWindow that
+        keeps the last window tokens (or all tokens if window is None).
+        """
+        if scanner not in ('regex', 'split', 'parallel'):
+            raise ValueError(f"Scanner {scanner} is not a valid scanner.")
         self.sourceCode = sourceCode
+        self.scanner = scanner
+        self.workers = workers
         self.tokens = []
         self.curr_token = 0  # Used to iterate through tokens by get_next_token method
-        # Tokenize on initialization
-        self.tokenize()
+        # Error messages for unterminated comments
+        self.errors = []
+        # Source file and memory map used by from_mmap
+        self.source_file = None
+        self.source_map = None
+        if lazy:
+            self.tokens = TokenWindow(self.iter_tokens(), window)
+        else:
+            # Tokenize on initialization
+            self.tokenize()
 
     def tokenize(self):
         """
@@ -70,37 +197,347 @@ class Lexer:
 	Returns:
 	list: A list of tokens identified in the source code.
         """
+        if self.scanner == 'regex':
+            return self.tokenize_regex()
+        if self.scanner == 'parallel':
+            return self.tokenize_parallel()
+        return self.tokenize_split()
 
+    @staticmethod
+    def unterminated_comment_error(line, column):
+        """Return the error message for an unterminated comment starting at line and column"""
+        return f"Error: Unterminated comment (line {line}, column {column})"
+
+    def tokenize_regex(self):
+        """
+        Tokenize the source code in a single pass using the master pattern.
+        """
         self.tokens = []  # Clear tokens list incase tokenize method is run more than once
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
 
-	# Remove comments from source code
-        re_comments = r'\[\*[\s\S]*?\*\]'
-        self.sourceCode = re.sub(re_comments, '', self.sourceCode)
+    def tokenize_parallel(self):
+        """
+        Tokenize the source code in parallel with TokenStream.from_source,
+        which splits the source code at whitespace outside of comments and
+        tokenizes the chunks in worker processes. The tokens are the same as
+        the tokens returned by tokenize_regex.
+        """
+        # Imported here since token_stream imports this module
+        from token_stream import TokenStream
+        stream = TokenStream.from_source(self.sourceCode, workers=self.workers or os.cpu_count() or 1)
+        self.tokens = list(stream)
+        self.errors = stream.errors
+        return self.tokens
+
+    def iter_tokens(self, pos=0, line=1, line_start=0):
+        """
+        Generator that yields the tokens of the source code using the master pattern.
+        Comments and whitespace are matched like any other token class and
+        then discarded, so the source code is never copied and offsets are
+        the offsets in the original source code.
+        The line, column, and offset of each token are recorded in the same pass.
+        Scanning starts at offset pos, which must be the start of a token or
+        0, on the given line. line_start is the offset of the first
+        character in that line.
+        """
+        self.errors = []
+        source_code = self.sourceCode
+        for match in self.re_master.finditer(source_code, pos):
+            token_type = match.lastgroup
+            start = match.start()
+            if token_type == 'unterminated_comment':
+                self.errors.append(self.unterminated_comment_error(line, start - line_start + 1))
+                break
+            # Only comments and whitespace can contain newlines
+            if token_type == 'comment' or token_type == 'whitespace':
+                end = match.end()
+                newlines = source_code.count('\n', start, end)
+                if newlines:
+                    line += newlines
+                    line_start = source_code.rfind('\n', start, end) + 1
+                continue
+            yield Token(token_type, match.group(), line, start - line_start + 1, start)
+
+    def edit(self, start, end, text):
+        """
+        Replace the source code between offsets start and end with text, and
+        update the tokens by only re-lexing around the edit.
+        Lexing restarts one token before the last token that starts before
+        the edit and stops at the first new token past the edit that starts where an old
+        token started (shifted by the change in length), since the rest of
+        the tokens are then the same. The tokens after it are moved to their
+        new positions.
+        Only works on a Lexer created from source code with lazy=False.
+        Returns a tuple (first, old_end, new_end): the old tokens[first:old_end]
+        were replaced by the new tokens[first:new_end].
+        """
+        if isinstance(self.tokens, TokenWindow):
+            raise ValueError("Cannot edit the tokens of a lazy Lexer.")
+        tokens = self.tokens
+        # An unterminated comment hides the tokens after it, so lex to the end
+        resync = not self.errors
+        self.sourceCode = self.sourceCode[:start] + text + self.sourceCode[end:]
+        delta = len(text) - (end - start)
+        edit_end = start + len(text)  # End of the edit in the new source code
+
+        # The master pattern looks at most two characters past a match (a
+        # keyword followed by '!' depends on whether '=' follows), so the
+        # token before the last token that starts before the edit is the
+        # first token that can change
+        first = bisect.bisect_left(tokens, start, key=lambda token: token.offset) - 2
+        if first < 0:
+            first = 0
+            pos, line, line_start = 0, 1, 0
+        else:
+            pos = tokens[first].offset
+            line = tokens[first].line
+            line_start = pos - tokens[first].column + 1
+
+        new_tokens = []
+        old_end = first
+        resynced = None
+        for token in self.iter_tokens(pos, line, line_start):
+            if resync and token.offset >= edit_end:
+                while old_end < len(tokens) and tokens[old_end].offset + delta < token.offset:
+                    old_end += 1
+                if old_end < len(tokens) and tokens[old_end].offset + delta == token.offset:
+                    resynced = token
+                    break
+            new_tokens.append(token)
+        if resynced is None:
+            old_end = len(tokens)
+            moved = []
+        else:
+            # Only the tokens on the same line as the first unchanged token
+            # change column
+            old_line = tokens[old_end].line
+            line_delta = resynced.line - old_line
+            column_delta = resynced.column - tokens[old_end].column
+            moved = tokens[old_end:]
+            if delta or line_delta or column_delta:
+                moved = [token.moved(token.line + line_delta,
+                                     token.column + column_delta if token.line == old_line else token.column,
+                                     token.offset + delta)
+                         for token in moved]
+        tokens[first:] = new_tokens + moved
+        return first, old_end, first + len(new_tokens)
+
+    @classmethod
+    def from_tokens(cls, tokens, errors=(), source_code=''):
+        """
+        Create a Lexer with tokens that were already tokenized, such as a
+        TokenStream loaded from a token file
+        """
+        lexer = cls('')
+        lexer.sourceCode = source_code
+        lexer.tokens = tokens
+        lexer.errors = list(errors)
+        return lexer
+
+    @classmethod
+    def from_token_file(cls, path):
+        """
+        Create a Lexer with the tokens of a binary token file saved with
+        save_tokens(filename, format='bin'), without tokenizing again
+        """
+        # Imported here since token_cache imports this module
+        from token_cache import read_token_file
+        with open(path, 'rb') as tokens_bin:
+            stream = read_token_file(tokens_bin)
+        return cls.from_tokens(stream, stream.errors)
+
+    @classmethod
+    def from_file(cls, path, *, chunk_size=None, lazy=False, window=None):
+        """
+        Create a Lexer with the tokens of the source code file at path.
+        The file is tokenized with stream_tokens so the source code is never
+        held in memory all at once.
+        If lazy is True, the file is only read as tokens are read, and tokens
+        is a TokenWindow like with Lexer(..., lazy=True). Call close() once
+        the tokens are no longer needed.
+        """
+        lexer = cls('')
+        if lazy:
+            lexer.source_file = open(path, mode='r', encoding='utf-8-sig')
+            token_source = cls.stream_tokens(lexer.source_file, chunk_size=chunk_size, errors=lexer.errors)
+            lexer.tokens = TokenWindow(token_source, window)
+            return lexer
+        with open(path, mode='r', encoding='utf-8-sig') as source_file:
+            lexer.tokens = list(cls.stream_tokens(source_file, chunk_size=chunk_size, errors=lexer.errors))
+        return lexer
+
+    @classmethod
+    def from_mmap(cls, path):
+        """
+        Create a Lexer with the tokens of the source code file at path.
+        The file is memory-mapped and scanned as bytes, and each token is a
+        MappedToken that only decodes its lexeme when its value is read.
+        Call close() once the tokens are no longer needed.
+        """
+        lexer = cls('')
+        lexer.source_file = open(path, mode='rb')
+        # Empty files cannot be memory-mapped and have no tokens
+        if os.fstat(lexer.source_file.fileno()).st_size == 0:
+            return lexer
+        lexer.source_map = mmap.mmap(lexer.source_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Skip the UTF-8 byte order mark like the utf-8-sig encoding does
+        source_map = lexer.source_map
+        line_start = 3 if source_map[:3] == codecs.BOM_UTF8 else 0
+        line = 1
+        for match in cls.re_master_bytes.finditer(source_map, line_start):
+            token_type = match.lastgroup
+            start = match.start()
+            end = match.end()
+            if token_type == 'unterminated_comment':
+                lexer.errors.append(cls.unterminated_comment_error(line, start - line_start + 1))
+                break
+            if token_type == 'comment' or token_type == 'whitespace':
+                newlines = source_map[start:end].count(b'\n')
+                if newlines:
+                    line += newlines
+                    line_start = source_map.rfind(b'\n', start, end) + 1
+                continue
+            # Columns count bytes since the start of the line
+            lexer.tokens.append(MappedToken(token_type, source_map, start, end - start, line, start - line_start + 1))
+        return lexer
+
+    def close(self):
+        """Close the source file used by from_mmap and lazy from_file"""
+        self.tokens = []
+        if self.source_map is not None:
+            self.source_map.close()
+            self.source_map = None
+        if self.source_file is not None:
+            self.source_file.close()
+            self.source_file = None
+
+    @classmethod
+    def stream_tokens(cls, source_file, *, chunk_size=None, errors=None):
+        """
+        Generator that reads source_file in chunks of chunk_size characters
+        and yields its tokens one at a time.
+        Only the current chunk and any unfinished token at the end of the
+        previous chunk are held in memory. Comments are skipped chunk by
+        chunk. An unterminated comment runs to the end of the file and its
+        error message is appended to errors if errors is a list.
+        """
+        if chunk_size is None:
+            chunk_size = cls.stream_chunk_size
+        buffer = ''
+        buffer_offset = 0  # Offset of buffer[0] in the source code
+        line = 1
+        line_start = 0  # Offset of the first character in the current line
+        in_comment = False
+        comment_position = None  # Line and column where the current comment started
+        while True:
+            chunk = source_file.read(chunk_size)
+            at_eof = not chunk
+            buffer += chunk
+
+            pos = 0
+            while True:
+                # Skip to the end of the current comment
+                if in_comment:
+                    comment_end = buffer.find('*]', pos)
+                    if comment_end == -1:
+                        # Keep the last character in case it is the '*' of '*]'
+                        skip_to = max(pos, len(buffer) - 1)
+                    else:
+                        skip_to = comment_end + 2
+                        in_comment = False
+                    newlines = buffer.count('\n', pos, skip_to)
+                    if newlines:
+                        line += newlines
+                        line_start = buffer_offset + buffer.rfind('\n', pos, skip_to) + 1
+                    pos = skip_to
+                    if in_comment:
+                        break
+
+                match = cls.re_stream.match(buffer, pos)
+                if match is None:
+                    break
+                token_type = match.lastgroup
+                # A token touching the end of the chunk may continue in the
+                # next chunk, so scan it again once more input is read.
+                # Whitespace is skipped now, since whitespace continuing in
+                # the next chunk is skipped the same way, so a long run of
+                # it is not scanned again after every chunk.
+                if match.end() == len(buffer) and not at_eof and token_type != 'whitespace':
+                    break
+                start = pos
+                pos = match.end()
+
+                if token_type == 'open_comment':
+                    in_comment = True
+                    comment_position = (line, buffer_offset + start - line_start + 1)
+                elif token_type == 'whitespace':
+                    newlines = buffer.count('\n', start, pos)
+                    if newlines:
+                        line += newlines
+                        line_start = buffer_offset + buffer.rfind('\n', start, pos) + 1
+                else:
+                    offset = buffer_offset + start
+                    yield Token(token_type, match.group(), line, offset - line_start + 1, offset)
+
+            if at_eof:
+                if in_comment and errors is not None:
+                    errors.append(cls.unterminated_comment_error(*comment_position))
+                return
+            buffer = buffer[pos:]
+            buffer_offset += pos
+
+    def tokenize_split(self):
+        """
+        Tokenize the source code by splitting the source code on comments,
+        operators, and separators, and running the FSMs on each potential
+        token. Comments are skipped instead of being removed from the source
+        code, so offsets are the offsets in the original source code.
+        """
+        self.tokens = []  # Clear tokens list incase tokenize method is run more than once
+        self.errors = []
 
         # Split source code into tokens
+        re_comments = r'\[\*[\s\S]*?\*\]|\[\*[\s\S]*'
         re_operators = r'==|!=|<=|=>|\+|\-|\*|\/|<|>|='
         re_separators = r'\(|\)|\{|\}|\,|\;|\$|\s'
-        re_split_pattern = f'({re_operators})|({re_separators})'
-        potentialTokens = [token for token in re.split(re_split_pattern, self.sourceCode) if token and not token.isspace()]
+        re_split_pattern = f'({re_comments})|({re_operators})|({re_separators})'
+        pieces = re.split(re_split_pattern, self.sourceCode)
 
         token_checker_fsm = FSM()
 
-        # Iterate through each token checking if a match is found
-        for token in potentialTokens:
-            if token in self.symbols:
-                self.tokens.append(Token(self.symbols[token], token))
+        # Iterate through each piece checking if a match is found, keeping
+        # track of the position of each piece in the source code
+        line = 1
+        line_start = 0
+        offset = 0
+        for token in pieces:
+            if token is None:  # Group that did not match
+                continue
+            column = offset - line_start + 1
+            if token == '\n':
+                line += 1
+                line_start = offset + 1
 
-            elif token_checker_fsm.is_identifier(token): # Identifier
-                self.tokens.append(Token('identifier', token))
+            elif token.startswith('[*'):  # Comment
+                if not token.endswith('*]') or len(token) < 4:
+                    self.errors.append(self.unterminated_comment_error(line, column))
+                    break
+                newlines = token.count('\n')
+                if newlines:
+                    line += newlines
+                    line_start = offset + token.rfind('\n') + 1
 
-            elif token_checker_fsm.is_integer(token): # Integer
-                self.tokens.append(Token('integer', token))
+            elif not token or token.isspace():
+                pass
 
-            elif token_checker_fsm.is_real(token): # Real
-                self.tokens.append(Token('real', token))
+            elif token in self.symbols:
+                self.tokens.append(Token(self.symbols[token], token, line, column, offset))
 
-            else:
-                self.tokens.append(Token('illegal', token))
+            else: # Identifier, integer, real, or illegal
+                self.tokens.append(Token(token_checker_fsm.classify(token), token, line, column, offset))
+            offset += len(token)
 
         return self.tokens
 
@@ -111,37 +548,48 @@ class Lexer:
         For example: <integer='123'>
         """
         valid_token_count = len([token for token in self.tokens if token.type != 'illegal'])
-        
-        lines = self.sourceCode.split('\n')
-        token_count_per_line = []
-        for line in lines:
-            re_operators = r'==|!=|<=|=>|\+|\-|\*|\/|<|>|='
-            re_separators = r'\(|\)|\{|\}|\,|\;|\$|\s'
-            re_split_pattern = f'({re_operators})|({re_separators})'
-            potentialTokens = [token for token in re.split(re_split_pattern, line) if token and not token.isspace()]
-            if potentialTokens:
-                token_count_per_line.append(len(potentialTokens))
-        current_token = 0
+
         print('='*32, f" Tokens ({valid_token_count}) ", '='*33)
-        for token_count in token_count_per_line:
-            for i in range(token_count):
-                curr_token = self.tokens[current_token]
-                formatted_str = f"<{curr_token.type}='{curr_token.value}'>"
-                print(formatted_str, end=" ")
-                current_token += 1
+        # Start a new output line whenever a token is on a new source line
+        curr_line = None
+        for curr_token in self.tokens:
+            if curr_line is not None and curr_token.line != curr_line:
+                print()
+            curr_line = curr_token.line
+            formatted_str = f"<{curr_token.type}='{curr_token.value}'>"
+            print(formatted_str, end=" ")
+        if curr_line is not None:
             print()
         print('='*80)
             
-    def save_tokens(self, filename):
-        """Save tokens to a file"""
-        # Clear output file if already exists and write headers
-        with open(filename, 'w') as tokens_txt:
-            tokens_txt.write(f"{'Token':15}Lexeme\n\n")
+    def save_tokens(self, filename, format='text'):
+        """
+        Save tokens to a file.
+        format is 'text' to write one line per token, or 'bin' to write a
+        binary token file that can be loaded with from_token_file.
+        Either way the file is written with a single write.
+        """
+        if format == 'bin':
+            # Imported here since these modules import this module
+            from token_cache import write_token_file
+            from token_stream import TokenStream
+            stream = self.tokens
+            if not isinstance(stream, TokenStream):
+                stream = TokenStream.from_tokens(self.tokens)
+                stream.errors = list(self.errors)
+            with open(filename, 'wb') as tokens_bin:
+                write_token_file(tokens_bin, stream)
+            return
+        if format != 'text':
+            raise ValueError(f"Token file format {format} is not a valid format.")
 
-        # Append each token to output file
-        with open(filename, 'a') as tokens_txt:
-            for token in self.tokens:
-                tokens_txt.write(f"{token.type:15}{token.value}\n")
+        # Header, then one line per token
+        lines = [f"{'Token':15}{'Line:Column':15}Lexeme\n\n"]
+        for token in self.tokens:
+            position = f"{token.line}:{token.column}"
+            lines.append(f"{token.type:15}{position:15}{token.value}\n")
+        with open(filename, 'w') as tokens_txt:
+            tokens_txt.write(''.join(lines))
 
     def get_next_token(self):
         """
@@ -149,18 +597,48 @@ class Lexer:
         Return None once all tokens have been returned.
         This method is needed for syntax analyzer since it must iterate through tokens one by one.
         """
-        if self.curr_token >= len(self.tokens):
-            return None
-
-        next_token = self.tokens[self.curr_token]
-        self.curr_token += 1
+        next_token = self.token_at(self.curr_token)
+        if next_token is not None:
+            self.curr_token += 1
 
         return next_token
 
-    def peek_next_token(self):
-        if self.curr_token >= len(self.tokens):
+    def token_at(self, idx):
+        """
+        Return the token at position idx, or None if there is no such token.
+        In lazy mode this tokenizes the source code up to idx.
+        """
+        tokens = self.tokens
+        if isinstance(tokens, TokenWindow):
+            # Tokens that were already read are indexed directly, and the
+            # source code is only tokenized further on a miss
+            buffer_idx = idx - tokens.base
+            if 0 <= buffer_idx < len(tokens.buffer):
+                return tokens.buffer[buffer_idx]
+            if not tokens.fill(idx):
+                return None
+        elif idx >= len(tokens):
             return None
-        return self.tokens[self.curr_token]
+        return tokens[idx]
+
+    def has_token(self, idx):
+        """
+        Return True if there is a token at position idx.
+        In lazy mode this tokenizes the source code up to idx.
+        """
+        tokens = self.tokens
+        if isinstance(tokens, TokenWindow):
+            if 0 <= idx - tokens.base < len(tokens.buffer):
+                return True
+            return tokens.fill(idx)
+        return idx < len(tokens)
+
+    def peek_next_token(self, offset=0):
+        """
+        Return the token offset positions after the next token without
+        consuming it, or None if there is no such token
+        """
+        return self.token_at(self.curr_token + offset)
     
     def backtrack(self):
         """Backtrack one position"""
@@ -187,7 +665,7 @@ class Lexer:
     
     def get_next_token_val(self):
         """Return the value of the next token"""
-        if self.curr_token >= len(self.tokens):
+        next_token = self.token_at(self.curr_token)
+        if next_token is None:
             return ''
-        next_token = self.tokens[self.curr_token]
         return next_token.value
\ No newline at end of file
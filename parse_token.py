@@ -1,16 +1,126 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import FrozenInstanceError
+from enum import IntEnum
+
+# Token types in the order of their type codes
+TOKEN_TYPES = ('identifier', 'illegal', 'integer', 'keyword', 'operator', 'real', 'separator')
+# Map each token type to its type code
+TOKEN_TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
+class TokenKind(IntEnum):
+    """Type code of a token, in the same order as TOKEN_TYPES"""
+    IDENTIFIER = 0
+    ILLEGAL = 1
+    INTEGER = 2
+    KEYWORD = 3
+    OPERATOR = 4
+    REAL = 5
+    SEPARATOR = 6
+
+# Map each token type to its kind
+TOKEN_KINDS = {token_type: TokenKind(code) for token_type, code in TOKEN_TYPE_CODES.items()}
+# Token types whose values are interned so that they can be compared by identity
+INTERNED_KINDS = frozenset([TokenKind.IDENTIFIER, TokenKind.KEYWORD])
 
-@dataclass(frozen=True)
 class Token:
-    """Class for representing tokens"""
-    type: str
-    value: str
+    """
+    Class for representing tokens.
+    The token type is stored as a TokenKind in kind, and type returns it as
+    a string. line and column (both starting at 1) and offset (starting at 0)
+    give the position of the token in the source code, or None if unknown.
+    Positions are not compared when checking if two tokens are equal.
+    Tokens cannot be changed once created.
+    """
+    __slots__ = ('kind', 'value', 'line', 'column', 'offset')
 
-    def __post_init__(self):
+    def __init__(self, type, value, line=None, column=None, offset=None):
         # Check that token type is valid
-        valid_types = set(['identifier', 'illegal', 'integer', 'keyword', 'operator', 'real', 'separator'])
-        if self.type not in valid_types:
-            raise ValueError(f"Token type {self.type} is not a valid type.")
+        kind = TOKEN_KINDS.get(type)
+        if kind is None:
+            raise ValueError(f"Token type {type} is not a valid type.")
 
         # Call lower() on token value to ensure that all tokens are lowercase
-        object.__setattr__(self, 'value', self.value.lower())
+        value = value.lower()
+        if kind in INTERNED_KINDS:
+            value = sys.intern(value)
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'line', line)
+        object.__setattr__(self, 'column', column)
+        object.__setattr__(self, 'offset', offset)
+
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.kind]
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __delattr__(self, name):
+        raise FrozenInstanceError(f"cannot delete field '{name}'")
+
+    def moved(self, line, column, offset):
+        """Return a copy of the token at another position"""
+        token = Token.__new__(Token)
+        object.__setattr__(token, 'kind', self.kind)
+        object.__setattr__(token, 'value', self.value)
+        object.__setattr__(token, 'line', line)
+        object.__setattr__(token, 'column', column)
+        object.__setattr__(token, 'offset', offset)
+        return token
+
+    def __reduce__(self):
+        return (Token, (self.type, self.value, self.line, self.column, self.offset))
+
+    def __eq__(self, other):
+        if other.__class__ is not Token:
+            return NotImplemented
+        return self.kind == other.kind and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.type, self.value))
+
+    def __repr__(self):
+        return f"Token(type={self.type!r}, value={self.value!r})"
+
+class MappedToken:
+    """
+    Class for representing tokens whose lexeme is a view into a bytes-like
+    buffer such as a memory-mapped source file.
+    The lexeme is only decoded, and lowercased like Token values, the first
+    time value is read. offset is the byte offset of the lexeme in buffer.
+    """
+    __slots__ = ('kind', 'buffer', 'offset', 'length', 'line', 'column', '_value')
+
+    def __init__(self, type, buffer, offset, length, line=None, column=None):
+        self.kind = TOKEN_KINDS[type]
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self.line = line
+        self.column = column
+        self._value = None
+
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.kind]
+
+    @property
+    def value(self):
+        if self._value is None:
+            lexeme = self.buffer[self.offset:self.offset + self.length]
+            self._value = lexeme.decode('utf-8').lower()
+            if self.kind in INTERNED_KINDS:
+                self._value = sys.intern(self._value)
+        return self._value
+
+    def __eq__(self, other):
+        if not isinstance(other, (Token, MappedToken)):
+            return NotImplemented
+        return self.kind == other.kind and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.type, self.value))
+
+    def __repr__(self):
+        return f"MappedToken(type={self.type!r}, value={self.value!r})"
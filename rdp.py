@@ -1,33 +1,98 @@
 """Recursive Descent Parser for Syntax Analysis"""
+from dataclasses import dataclass
+
+from codegen import generate_code
+from parse_token import TOKEN_KINDS
 from sym_table import SymbolTable
+from syntax_tree import (Assign, BinaryOp, Boolean, Call, Compound, Condition,
+                         Function, Identifier, If, Incomplete, Integer, Negate,
+                         Parenthesized, Print, Program, Real, Return, Scan, While)
+from trace_writer import TraceWriter
+
+# Expression rules parsed by RDP.parse_expression
+EXPRESSION = 0
+EXPRESSION_PRIME = 1
+TERM = 2
+TERM_PRIME = 3
+FACTOR = 4
+# What RDP.parse_expression does after parsing a rule: continue the rule
+# it is nested in, building the node of that rule
+PARSED = 5
+ADD = 6
+SUBTRACT = 7
+MULTIPLY = 8
+DIVIDE = 9
+NEGATE = 10
+CLOSE_PARENTHESIS = 11
+# Check the last operand of a <Term_prime> once the rest of it is parsed
+CHECK_LAST_OPERAND = 12
+# Operator of the node built after parsing the right operand of ADD,
+# SUBTRACT, MULTIPLY, and DIVIDE
+BINARY_OPERATORS = {ADD: '+', SUBTRACT: '-', MULTIPLY: '*', DIVIDE: '/'}
+# Tokens that close the blocks of statements, by the tokens that open them
+BLOCK_CLOSERS = {'{': '}', 'while': 'endwhile', 'if': 'endif'}
+
+@dataclass(slots=True)
+class Diagnostic:
+  """
+  Error found by the parser. token_index is the index of the next token
+  when the error was found, and line and column are the position of the
+  error in the source code, or None if it is not known.
+  """
+  message: str
+  token_index: int
+  line: int = None
+  column: int = None
+
+  def __str__(self):
+    if not self.line:
+      return self.message
+    return f"{self.message} (line {self.line}, column {self.column})"
 
 class RDP:
-  def __init__(self, lexer, *, print_to_console=False, out_filename=None):
+  def __init__(self, lexer, *, print_to_console=False, out_filename=None, trace=None, recover=False):
     self.lexer = lexer
     self.print_to_console = print_to_console
     self.out_filename = out_filename
     self.print_buffer = []  # Used to print tokens after printing production
     # Store left-hand side of production until right-hand side is determined
     self.print_production_buffer = []
-    self.asm_instructions = []
+    # Output held back until the productions reserved by defer_production
+    # are resolved. Reserved productions are lists holding the production,
+    # or None while it is unresolved.
+    self.deferred_output = []
+    # Syntax tree nodes of the parsed productions. Each production pushes
+    # its node, and productions containing other productions pop the nodes
+    # of the productions they contain.
+    self.nodes = []
+    # Number of semantic errors, such as undeclared identifiers
+    self.semantic_errors = 0
+    # Diagnostics of the syntax and semantic errors, in the order they are found
+    self.diagnostics = []
+    # If True, the parser recovers from syntax errors in panic mode instead
+    # of stopping at the first one: it skips the tokens of the statement or
+    # section of the program with the error, and goes on parsing
+    self.recover = recover
+    # Closers of the blocks being parsed, such as '}' for a compound
+    # statement, innermost last. Blocks that fail to parse are left open
+    # until the parser recovers.
+    self.blocks = []
     self.symbol_table = SymbolTable()
-    # Stores which functions are checking for recursive functions
-    self.checking_recursive = {
-      'is_function_definitions_recursive': False,
-      'is_parameter_list_recursive' : False,
-      'is_IDs_recursive' : False,
-      'is_statement_list_recursive' : False
-    }
     # For use when testing a single production rule
     self.ignore_symbol_table = False
     self.in_declaration_list = False
     self.in_scan = False
     self.in_print = False
-    
-    # Clear out file if it is set
-    if self.out_filename:
-        with open(self.out_filename, 'w') as out_txt:
-          out_txt.write("")
+    # Sink of the printed and saved output, or None if there is no output.
+    # Productions and tokens are not formatted without one. trace can be
+    # given to use another sink, such as a StructuredTraceWriter.
+    if trace is None:
+      trace = TraceWriter.open(print_to_console=print_to_console, out_filename=out_filename)
+    self.trace = trace
+    # Number of statements being parsed that the current one is nested in,
+    # written with each line of output if the trace records depths
+    self.depth = 0
+    self.records_depth = trace is not None and trace.records_depth
     
   def token_is(self, token_type, token_val=None):
     """
@@ -37,13 +102,10 @@ class RDP:
     next_token = self.lexer.get_next_token()
     if next_token is None:
       return False
-    if next_token.type == token_type and token_val == None:
-      last_token = self.lexer.get_prev_token()
-      self.print_token(last_token)
-      return True
-    elif next_token.type == token_type and token_val == next_token.value:
-      last_token = self.lexer.get_prev_token()
-      self.print_token(last_token)
+    # Compare token kinds instead of type strings. Keyword and identifier
+    # values are interned so comparing them with token_val is cheap
+    if next_token.kind == TOKEN_KINDS[token_type] and (token_val is None or token_val == next_token.value):
+      self.print_token(next_token)
       return True
     
     # Backtrack if token type not equal to token_type
@@ -52,55 +114,127 @@ class RDP:
   
   def print_production(self, production, *, to_be_continued=False):
     """Print and append to file the current production"""
-    if self.is_checking_recursive():
+    if self.trace is None:
       return
 
-    prod = f"{'':2}{production}"
+    prod = '  ' + production
     if to_be_continued:
       self.print_production_buffer.append(prod)
-    elif self.print_to_console:
-      print(prod)
-        
-    if self.out_filename:
-      # Append to outfile here
-      if not to_be_continued:
-        self.append_to_file(prod)
-        
+    else:
+      self.write_output(prod)
+
+  def defer_production(self):
+    """
+    Reserve the place of a production whose right-hand side depends on the
+    tokens after the first symbol, such as whether a list has more
+    elements. Output after it is held back until it is resolved with
+    resolve_production, so the output stays in order.
+    """
+    # Nothing has to be held back if the output is not printed or saved
+    if self.trace is None:
+      return None
+    production = [None]
+    if self.records_depth:
+      production.append(self.depth)
+    self.deferred_output.append(production)
+    return production
+
+  def resolve_production(self, deferred_production, production):
+    """Set a production reserved by defer_production and write the output that was waiting on it"""
+    if deferred_production is None:
+      return
+    deferred_production[0] = '  ' + production
+    if self.records_depth:
+      deferred_production[0] = (deferred_production[0], deferred_production[1])
+    deferred_output = self.deferred_output
+    if deferred_output[0] is not deferred_production:
+      return
+    # Write the output up to the next unresolved production
+    idx = 0
+    while idx < len(deferred_output):
+      line = deferred_output[idx]
+      if isinstance(line, list):
+        if line[0] is None:
+          break
+        line = line[0]
+      self.write_line(line)
+      idx += 1
+    del deferred_output[:idx]
+
+  def write_output(self, line):
+    """Print and append to file a line of output, unless it has to wait for a deferred production"""
+    if self.records_depth:
+      line = (line, self.depth)
+    if self.deferred_output:
+      self.deferred_output.append(line)
+    else:
+      self.write_line(line)
+
+  def write_line(self, line):
+    """Print and append to file a line of output, a string or a token"""
+    self.trace.write(line)
+
+  def flush_output(self):
+    """Print and write to the output file the output buffered by the trace writer"""
+    if self.trace is not None:
+      self.trace.flush()
+
+  def close(self):
+    """Write the rest of the output and close the output file"""
+    if self.trace is not None:
+      self.trace.close()
+
   def finish_production_print(self, production):
     """Print the right hand side of a production that was started but not finished"""
-    if self.is_checking_recursive():
+    if self.trace is None:
       return
 
     left_hand_side = ' '.join(self.print_production_buffer)
     self.print_production_buffer.clear()
     prod = f"{left_hand_side} {production}"
-    if self.print_to_console:
-      print(prod)
-    
-    if self.out_filename:
-      self.append_to_file(prod)
+    self.write_output(prod)
 
   def print_token(self, token):
     """Print token and append to file a token"""
-    if self.is_checking_recursive():
+    if self.trace is None:
       return
 
-    tok = f"Token: {token.type:15} Lexeme: {token.value}"
-    if self.print_to_console:
-      print(tok)
-      
-    if self.out_filename:
-      self.append_to_file(f"{tok}")
+    # Formatted by the trace writer when it writes the token
+    self.write_output(token)
       
-  def append_to_file(self, txt):
-    """Append txt to output file"""
-    with open(self.out_filename, 'a') as out_txt:
-      out_txt.write(f"{txt}\n")
+  def diagnostic(self, message, token=None):
+    """
+    Return a Diagnostic of message at the position of token.
+    If token is None, use the position of the next token, or of the last
+    token when all tokens have been read.
+    """
+    if token is None:
+      token = self.lexer.peek_next_token()
+      if token is None and self.lexer.curr_token > 0:
+        token = self.lexer.get_prev_token()
+    if token is None or not token.line:
+      return Diagnostic(message, self.lexer.curr_token)
+    return Diagnostic(message, self.lexer.curr_token, token.line, token.column)
+
+  def print_error(self, message, token=None):
+    """
+    Print and append to file an error message with its position in the
+    source code, and add it to the diagnostics. Returns the printed message.
+    """
+    diagnostic = self.diagnostic(message, token)
+    self.diagnostics.append(diagnostic)
+    self.print_production(str(diagnostic))
+    return str(diagnostic)
 
   def write_symbol_table(self, filename):
     """Write symbol table to a file"""
     self.symbol_table.write(filename)
 
+  @property
+  def asm_instructions(self):
+    """Assembly instructions generated from the syntax tree nodes of the parsed productions"""
+    return generate_code(self.nodes)
+
   def write_asm_instructions(self, filename):
     """
     Write assembly instructions and symbol table to a file
@@ -116,82 +250,131 @@ class RDP:
     # Append symbol table
     self.symbol_table.write(filename, append_to_file=True)
 
-  def is_checking_recursive(self):
+  def pop_nodes(self, node_count):
+    """Remove and return the nodes pushed after the first node_count nodes"""
+    nodes = self.nodes[node_count:]
+    del self.nodes[node_count:]
+    return nodes
+
+  def push_incomplete(self, node_type, node_count, part_count):
     """
-    Returns True if any function is checking for recursive functions, False otherwise
+    Replace the nodes pushed after the first node_count nodes with an
+    Incomplete node of node_type, a node type with part_count parts, for a
+    production that failed. Parts that were not parsed are None.
     """
-    for func_name, bool in self.checking_recursive.items():
-      if bool == True:
-        return True
-    return False
-  
-  def swap_last_two_instructions(self):
-    """Swap the last two instructions in self.asm_instructions"""
-    # Check that there are at least two instructions
-    if self.ignore_symbol_table or self.is_checking_recursive():
-      return
+    parts = self.pop_nodes(node_count)
+    parts += [None] * (part_count - len(parts))
+    self.nodes.append(Incomplete(node_type(*parts)))
 
-    if len(self.asm_instructions) < 2:
-      raise ValueError("Cannot swap instructions because there less than 2")
-
-    last = self.asm_instructions[-1]
-    second = self.asm_instructions[-2]
-    self.asm_instructions[-1] = second
-    self.asm_instructions[-2] = last
-
-  def insert_PUSHM(self):
-    """Insert PUSHM instruction"""
-    if not self.is_checking_recursive() and not self.ignore_symbol_table:
-      prev_tok = self.lexer.get_prev_token()
-      if not self.symbol_table.exists_identifier(prev_tok):
-        err_msg = f"Error: Identifier {prev_tok.value} was not declared"
-        self.print_production(err_msg)
-        self.asm_instructions.append(err_msg)
-        return False
-      mem_address = self.symbol_table.get_mem_address(prev_tok)
-      self.asm_instructions.append(f"PUSHM {mem_address}")
+  def identifier_node(self, token):
+    """
+    Return an Identifier node for the identifier token that is used in a
+    statement, with its memory address. If the identifier was not declared,
+    the error message is kept in the node instead. The error is reported by
+    check_identifier where the identifier is checked.
+    """
+    node = Identifier(token.value, token)
+    if self.ignore_symbol_table:
+      return node
+    if self.symbol_table.exists_identifier(token):
+      node.address = self.symbol_table.get_mem_address(token)
+    else:
+      node.error = str(self.diagnostic(f"Error: Identifier {token.value} was not declared", token))
+    return node
+
+  def check_identifier(self, token):
+    """
+    Report token if it is an identifier that was not declared, counting it
+    as a semantic error. Returns False if it was reported, True otherwise.
+    """
+    if token.type != 'identifier' or self.symbol_table.exists_identifier(token):
+      return True
+    self.print_error(f"Error: Identifier {token.value} was not declared", token)
+    self.semantic_errors += 1
+    return False
 
   def rat24s(self):
       """
       R1. <Rat24S> ::= $ <Opt Function Definitions> $ <Opt Declaration List> $ <Statement List> $
+      Returns False if the program has syntax errors. Semantic errors, such
+      as undeclared identifiers, are reported and make the rule they are in
+      fail, which only makes the program invalid if the list of statements
+      or functions the rule is in cannot end there (see is_list_parsed).
+      With error recovery, a section of the program with a syntax error is
+      skipped up to the next $, and the errors of every section are in
+      diagnostics.
+      The output is written by the time it returns.
       """
-      # Check for the first $ symbol.
-      if not self.token_is('separator', '$'):
-          self.print_production("Error: Expected '$' at the beginning of the program.")
-          return False
-      else:
+      try:
+        node_count = len(self.nodes)
+        diagnostic_count = len(self.diagnostics)
+        semantic_errors = self.semantic_errors
+        # Check for the first $ symbol.
+        if not self.separator("Error: Expected '$' at the beginning of the program."):
+            return False
         self.print_production("<Rat24S> --> $ <Opt Function Definitions> $ <Opt Declaration List> $ <Statement List> $")
         
-      # Optionally parse function definitions.
-      if not self.opt_function_definitions():
-          self.print_production("Error: Issue parsing optional function definitions.")
-          return False
+        # Optionally parse function definitions.
+        if not self.opt_function_definitions():
+            self.print_error("Error: Issue parsing optional function definitions.")
+            if not self.recover:
+                return False
+            del self.nodes[node_count:]
+            self.skip_section()
 
-      # Check for the $ symbol after optional function definitions.
-      if not self.token_is('separator', '$'):
-          self.print_production("Error: Expected '$' after optional function definitions.")
-          return False
+        function_count = len(self.nodes) - node_count
 
-      # Optionally parse declaration list.
-      if not self.opt_declaration_list():
-          self.print_production("Error: Issue parsing optional declaration list.")
-          return False
+        # Check for the $ symbol after optional function definitions.
+        if not self.separator("Error: Expected '$' after optional function definitions."):
+            return False
 
-      # Check for the $ symbol after optional declaration list.
-      if not self.token_is('separator', '$'):
-          self.print_production("Error: Expected '$' after optional declaration list.")
-          return False
+        # Optionally parse declaration list.
+        if not self.opt_declaration_list():
+            self.print_error("Error: Issue parsing optional declaration list.")
+            if not self.recover:
+                return False
+            self.skip_section()
 
-      # Parse statement list.
-      if not self.statement_list():
-          self.print_production("Error: Issue parsing statement list.")
-          return False
+        # Check for the $ symbol after optional declaration list.
+        if not self.separator("Error: Expected '$' after optional declaration list."):
+            return False
 
-      # Check for the final $ symbol indicating the end of the program.
-      if not self.token_is('separator', '$'):
-          self.print_production("Error: Expected final '$' at the end of the program.")
-          return False
+        # Parse statement list.
+        if not self.statement_list():
+            self.print_error("Error: Issue parsing statement list.")
+            if not self.recover:
+                return False
+            del self.nodes[node_count + function_count:]
+            self.skip_section()
+
+        # Check for the final $ symbol indicating the end of the program.
+        if not self.separator("Error: Expected final '$' at the end of the program."):
+            return False
+        nodes = self.pop_nodes(node_count)
+        self.nodes.append(Program(nodes[:function_count], nodes[function_count:]))
+        if not self.recover:
+          return True
+        # Every diagnostic that is not a semantic error is a syntax error
+        # the parser recovered from
+        return len(self.diagnostics) - diagnostic_count == self.semantic_errors - semantic_errors
+      finally:
+        # Write the output of the program buffered by the trace writer
+        self.flush_output()
+
+  def separator(self, message):
+    """
+    Parse the $ before or after a section of the program. If it is not
+    the next token, message is printed. With error recovery, the tokens
+    before the next $ are then skipped and it is parsed instead.
+    Returns False if no $ was parsed.
+    """
+    if self.token_is('separator', '$'):
       return True
+    self.print_error(message)
+    if not self.recover:
+      return False
+    self.skip_section()
+    return self.token_is('separator', '$')
 
   def opt_function_definitions(self):
     """
@@ -208,37 +391,39 @@ class RDP:
       return True
     return False
   
-  def is_function_definitions_recursive(self):
-    """Return True if function definitions includes more than one function, False otherwise"""
-    self.checking_recursive['is_function_definitions_recursive'] = True
-    curr = self.lexer.curr_token
-    # Read first function
-    self.function()
-    is_recursive = self.function()
-    self.lexer.curr_token = curr
-    self.checking_recursive['is_function_definitions_recursive'] = False
-    return is_recursive
-  
   def function_definitions(self):
     """
     R3. <Function Definitions> ::= <Function> | <Function> <Function Definitions>
+    The production is known once the first function has been parsed: there
+    is more than one function if the next token is function.
+    """
+    # Each iteration parses the <Function> of one <Function Definitions>
+    semantic_errors = None
+    while True:
+      production = self.defer_production()
+      is_function = self.function()
+      # Check only function if program contains only one more function
+      if self.lexer.get_next_token_val() != 'function':
+        self.resolve_production(production, "<Function Definitions> --> <Function>")
+        break
+      self.resolve_production(production, "<Function Definitions> --> <Function> <Function Definitions>")
+      if not is_function:
+        break
+      if semantic_errors is None:
+        semantic_errors = self.semantic_errors
+    return self.is_list_parsed(is_function, semantic_errors)
+
+  def is_list_parsed(self, is_last_element, semantic_errors):
     """
-    #self.print_production("<Function Definitions> --> <Function> | <Function> <Function Definitions>")
-    is_recursive = self.is_function_definitions_recursive()
-    # Check function and function definitions if program contains more than one function
-    if is_recursive:
-      self.print_production("<Function Definitions> --> <Function> <Function Definitions>")
-      if self.function():
-        if self.function_definitions():
-          return True
-        return True
-      return False
-    else:  # Check only function if program contains only one function
-      self.print_production("<Function Definitions> --> <Function>")
-      if self.function():
-        return True
-      else:
-        return False
+    Return True if a list whose last parsed element returned
+    is_last_element was parsed. semantic_errors is the number of semantic
+    errors after the first element, or None if the list stopped at the
+    first element. Semantic errors after the first element do not make the
+    list fail, only syntax errors do.
+    """
+    if is_last_element:
+      return True
+    return semantic_errors is not None and self.semantic_errors > semantic_errors
 
   def function(self):
       """
@@ -247,24 +432,29 @@ class RDP:
       if self.token_is('keyword', 'function'):
           # Expecting a single identifier for the function name.
           if self.token_is('identifier'):  # Adjusted from IDs() to expect a single identifier.
+              name = self.lexer.get_prev_token().value
+              node_count = len(self.nodes)
               if self.token_is('separator', '('):
                   if self.opt_parameter_list():  # Parse optional parameter list.
                       if self.token_is('separator', ')'):
                           if self.opt_declaration_list():  # Parse optional declaration list.
                               if self.body():  # Parse the function body.
+                                  self.nodes.append(Function(name, self.pop_nodes(node_count)))
                                   return True
                               else:
-                                  self.print_production("Error: Invalid function body.")
+                                  self.print_error("Error: Invalid function body.")
                           else:
-                              self.print_production("Error: Issue within optional declaration list.")
+                              self.print_error("Error: Issue within optional declaration list.")
                       else:
-                          self.print_production("Error: Expected ')' after parameters.")
+                          self.print_error("Error: Expected ')' after parameters.")
                   else:
-                      self.print_production("Error: Issue within optional parameter list.")
+                      self.print_error("Error: Issue within optional parameter list.")
               else:
-                  self.print_production("Error: Expected '(' after function name.")
+                  self.print_error("Error: Expected '(' after function name.")
+              # Keep the statements parsed before the error
+              self.nodes.append(Incomplete(Function(name, self.pop_nodes(node_count))))
           else:
-              self.print_production("Error: Expected identifier after 'function' keyword.")
+              self.print_error("Error: Expected identifier after 'function' keyword.")
       return False
 
   
@@ -286,51 +476,34 @@ class RDP:
     self.print_production("<Opt Parameter List> --> <Empty>")
     return True
   
-  def is_parameter_list_recursive(self):
-    """Return True if <Parameter occurs more than once, False otherwise"""
-    self.checking_recursive['is_parameter_list_recursive'] = True
-    curr = self.lexer.curr_token
-    # Read first function
-    self.parameter()
-    next_tok = self.lexer.peek_next_token()
-    if next_tok and next_tok.value == ',':
-      is_recursive = True
-    else:
-      is_recursive = False
-    self.lexer.curr_token = curr
-    self.checking_recursive['is_parameter_list_recursive'] = False
-    return is_recursive
-  
   def parameter_list(self):
       """
       R6. <Parameter List> ::= <Parameter> | <Parameter>, <Parameter List>
+      The production is known once the first parameter has been parsed:
+      there is more than one parameter if the next token is a comma.
       """
-      is_recursive = self.is_parameter_list_recursive()
-      
-      if is_recursive:
-        self.print_production("<Parameter List> --> <Parameter>, <Parameter List>")
-        if self.parameter():
-          if self.token_is('separator', ','):
-            if self.parameter_list():
-              return True
-            else:
-              return False
-          else:
-            return False
-        else:
+      # Each iteration parses the <Parameter> of one <Parameter List>
+      while True:
+        production = self.defer_production()
+        is_parameter = self.parameter()
+        next_tok = self.lexer.peek_next_token()
+        if not (next_tok and next_tok.value == ','):
+          self.resolve_production(production, "<Parameter List> --> <Parameter>")
+          return is_parameter
+        self.resolve_production(production, "<Parameter List> --> <Parameter>, <Parameter List>")
+        if not is_parameter or not self.token_is('separator', ','):
           return False
-      else:
-        self.print_production("<Parameter List> --> <Parameter>")
-        if self.parameter():
-          return True
-        return False
   
   def parameter(self):
     """
     R7. <Parameter> ::= <IDs> <Qualifier>
     """
     self.print_production("<Parameter> --> <IDs> <Qualifier>")
-    if self.IDs() and self.qualifier():
+    node_count = len(self.nodes)
+    is_IDs = self.IDs()
+    # Parameters do not generate code
+    del self.nodes[node_count:]
+    if is_IDs and self.qualifier():
         return True
     return False
     
@@ -359,11 +532,11 @@ class RDP:
         if self.token_is('separator', '}'):
           return True
         else:
-          self.print_production("Error: Expected '}' at the end of the body.")
+          self.print_error("Error: Expected '}' at the end of the body.")
       else:
-        self.print_production("Error: Invalid statement list inside body.")
+        self.print_error("Error: Invalid statement list inside body.")
     else:
-        self.print_production("Error: Expected '{' at the beginning of the body.")
+        self.print_error("Error: Expected '{' at the beginning of the body.")
     return False
   
   def opt_declaration_list(self):
@@ -442,125 +615,238 @@ class RDP:
     return False
   
   def is_IDs_recursive(self):
-    """Return True if there is more than one IDs, False otherwise"""
-    self.checking_recursive['is_IDs_recursive'] = True
-    curr = self.lexer.curr_token
-    self.token_is('identifier')
+    """
+    Return True if there is more than one IDs, False otherwise.
+    Looks at most two tokens ahead: the identifier and the comma after it.
+    """
     next_token = self.lexer.peek_next_token()
+    if next_token and next_token.type == 'identifier':
+      next_token = self.lexer.peek_next_token(1)
     if next_token and next_token.value == ',':
-      is_recursive = True
-    else:
-      is_recursive = False
-    self.lexer.curr_token = curr
-    self.checking_recursive['is_IDs_recursive'] = False
-    return is_recursive
+      return True
+    return False
 
   def IDs(self):
       """
       R12. <IDs> ::= <Identifier> | <Identifier>, <IDs>
+      Pushes an Identifier node for each identifier, except in declaration
+      lists, where the identifiers are inserted in the symbol table instead.
+      In scan statements, each identifier but the last is checked as it is
+      parsed, and the last one is checked by scan.
       """
-      is_recursive = self.is_IDs_recursive()
-      
-      if is_recursive:
+      # Each iteration parses the <Identifier> of one <IDs>
+      while self.is_IDs_recursive():
         self.print_production("<IDs> --> <Identifier>, <IDs>")
-        if self.token_is('identifier'):
-          # Insert to symbol table with type None (will be updated with last 
-          # symbol in declaration list)
-          if not self.is_checking_recursive() and not self.ignore_symbol_table and self.in_scan:
-            id_tok = self.lexer.get_prev_token()
-            if not self.symbol_table.exists_identifier(id_tok):
-              err_msg = f"Error: Identifier {id_tok.value} was not declared"
-              self.print_production(err_msg)
-              self.asm_instructions.append(err_msg)
-              return False
-            id_mem_address = self.symbol_table.get_mem_address(id_tok)
-            self.asm_instructions.append('SIN')
-            self.asm_instructions.append(f"POPM {id_mem_address}")
-
-          if self.in_declaration_list:
-            prev_tok = self.lexer.get_prev_token()
-            self.symbol_table.insert(prev_tok, None)
-          if self.token_is('separator', ','):
-            if self.IDs():
-              return True
-            else:
-              return False
-          else:
+        if not self.token_is('identifier'):
+          return False
+        id_tok = self.lexer.get_prev_token()
+        # Insert to symbol table with type None (will be updated with last 
+        # symbol in declaration list)
+        if self.in_declaration_list:
+          self.symbol_table.insert(id_tok, None)
+        elif self.in_scan and not self.ignore_symbol_table:
+          self.nodes.append(self.identifier_node(id_tok))
+          if not self.check_identifier(id_tok):
             return False
         else:
+          self.nodes.append(Identifier(id_tok.value, id_tok))
+        if not self.token_is('separator', ','):
           return False
+      self.print_production("<IDs> --> <Identifier>")
+      if self.token_is('identifier'):
+        if self.in_scan:
+          id_tok = self.lexer.get_prev_token()
+          self.nodes.append(self.identifier_node(id_tok))
+        elif not self.in_declaration_list:
+          id_tok = self.lexer.get_prev_token()
+          self.nodes.append(Identifier(id_tok.value, id_tok))
+        return True
       else:
-        self.print_production("<IDs> --> <Identifier>")
-        if self.token_is('identifier'):
-          return True
-        else:
-          return False
+        return False
         
-  def is_statement_list_recursive(self):
-    """Return True if statement occurs more than once, false otherwise"""
-    curr = self.lexer.curr_token
-    self.checking_recursive[f'is_statement_list_recursive{curr}'] = True
-    self.statement()
-    is_recursive = self.statement()
-    self.lexer.curr_token = curr
-    self.checking_recursive[f'is_statement_list_recursive{curr}'] = False
-    return is_recursive
+  def starts_statement(self, token):
+    """Return True if token is in the FIRST set of <Statement>, False otherwise"""
+    FIRST = set(['{', 'if', 'return', 'print', 'scan', 'while'])
+    if token is None:
+      return False
+    return token.type == 'identifier' or token.value in FIRST
+
+  def run_steps(self, steps):
+    """
+    Run the generator steps of a production that contains statements and
+    return its result.
+    Statements can be nested as deep as the program goes, so instead of
+    calling each other, the productions that contain statements are
+    generators that yield the generator of each statement or statement
+    list they contain, and get back its result. The generators are kept on
+    an explicit stack so nesting does not use the Python call stack.
+    """
+    stack = [steps]
+    result = None
+    while True:
+      try:
+        nested_steps = stack[-1].send(result)
+      except StopIteration as stop:
+        stack.pop()
+        if not stack:
+          return stop.value
+        result = stop.value
+      else:
+        stack.append(nested_steps)
+        result = None
 
   def statement_list(self):
     """
     R13. <Statement List> ::= <Statement> | <Statement> <Statement List>
+    The production is known once the first statement has been parsed: there
+    is more than one statement if the next token can start a statement.
     """
-    is_recursive = self.is_statement_list_recursive()
-    if is_recursive:
-      self.print_production("<Statement List> --> <Statement> <Statement List>")
-      if self.statement():
-        if self.statement_list():
-          return True
-        return True
-      return False
-    else:
-      self.print_production("<Statement List> --> <Statement>")
-      if self.statement():
-        return True
-      return False
+    return self.run_steps(self.statement_list_steps())
+
+  def statement_list_steps(self):
+    """
+    Generator with the steps of statement_list for run_steps.
+    With error recovery, a statement that fails to parse, and would make
+    the list fail, is reported and skipped, and the list goes on with the
+    next statement.
+    """
+    # Each iteration parses the <Statement> of one <Statement List>
+    semantic_errors = None
+    while True:
+      production = self.defer_production()
+      node_count = len(self.nodes)
+      block_count = len(self.blocks)
+      is_statement = yield self.statement_steps()
+      if not is_statement and self.recover and not self.is_list_parsed(is_statement, semantic_errors):
+        self.recover_statement(node_count, block_count)
+        is_statement = True
+      if not self.starts_statement(self.lexer.peek_next_token()):
+        self.resolve_production(production, "<Statement List> --> <Statement>")
+        break
+      self.resolve_production(production, "<Statement List> --> <Statement> <Statement List>")
+      if not is_statement:
+        break
+      if semantic_errors is None:
+        semantic_errors = self.semantic_errors
+    return self.is_list_parsed(is_statement, semantic_errors)
   
+  def recover_statement(self, node_count, block_count):
+    """
+    Report a statement that failed to parse and skip the rest of it.
+    node_count and block_count are the number of nodes and open blocks
+    before the statement.
+    """
+    token = self.lexer.peek_next_token()
+    if token is None:
+      self.print_error("Error: Unexpected end of program in statement.")
+    else:
+      self.print_error(f"Error: Unexpected '{token.value}' in statement.")
+    # The statement has no node, and its production was not finished
+    del self.nodes[node_count:]
+    self.print_production_buffer.clear()
+    blocks = self.blocks[block_count:]
+    del self.blocks[block_count:]
+    self.synchronize(blocks)
+
+  def synchronize(self, blocks):
+    """
+    Skip the rest of a statement with a syntax error, from where parsing
+    stopped. blocks are the closers of the blocks the statement opened that
+    are still open, innermost last. Tokens are skipped up to and including
+    the ; or closer that ends the statement once its blocks are closed.
+    Skipping stops before a closer of a block the statement is in, and
+    before $. Each token is skipped at most once, so recovering from every
+    error of a program takes time linear in its number of tokens.
+    """
+    lexer = self.lexer
+    closers = BLOCK_CLOSERS.values()
+    while True:
+      token = lexer.peek_next_token()
+      if token is None or token.value == '$':
+        return
+      value = token.value
+      if value in closers:
+        if value not in blocks:
+          # The closer of a block the statement is in
+          return
+        # Blocks missing their closers are closed with the outer block
+        while blocks.pop() != value:
+          pass
+        lexer.get_next_token()
+        if not blocks:
+          return
+      elif value in BLOCK_CLOSERS:
+        blocks.append(BLOCK_CLOSERS[value])
+        lexer.get_next_token()
+      else:
+        lexer.get_next_token()
+        if value == ';' and not blocks:
+          return
+
+  def skip_section(self):
+    """Skip the tokens before the next $, to recover from a syntax error in a section of the program"""
+    token = self.lexer.peek_next_token()
+    while token is not None and token.value != '$':
+      self.lexer.get_next_token()
+      token = self.lexer.peek_next_token()
+
   def statement(self):
     """
     R14. <Statement> ::= <Compound> | <Assign> | <If> | <Return> | <Print> | <Scan> | <While>
     """
-    if not self.is_checking_recursive():
-      self.print_production("<Statement> -->", to_be_continued=True)
-    if self.compound():
-      return True
+    return self.run_steps(self.statement_steps())
+
+  def statement_steps(self):
+    """Generator with the steps of statement for run_steps"""
+    self.print_production("<Statement> -->", to_be_continued=True)
+    node_count = len(self.nodes)
+    # The statement is nested one level deeper
+    self.depth += 1
+    if (yield self.compound_steps()):
+      is_statement = True
     elif self.assign():
-      return True
-    elif self.If():
-       return True
+      is_statement = True
+    elif (yield self.If_steps()):
+      is_statement = True
     elif self.Return():
-       return True
+      is_statement = True
     elif self.Print():
-       return True
+      is_statement = True
     elif self.scan():
-       return True
-    elif self.While():
-       return True
+      is_statement = True
+    elif (yield self.While_steps()):
+      is_statement = True
     else:
-       return False
+      is_statement = False
+    self.depth -= 1
+    if len(self.nodes) > node_count + 1:
+      # Statements that failed before the one that parsed are kept with it,
+      # so the statement has one node
+      statements = Compound(self.pop_nodes(node_count))
+      self.nodes.append(statements if is_statement else Incomplete(statements))
+    return is_statement
   
   def compound(self):
     """
     R15. <Compound> ::= { <Statement List> }
     """
+    return self.run_steps(self.compound_steps())
+
+  def compound_steps(self):
+    """Generator with the steps of compound for run_steps"""
     if self.token_is('separator', '{'):
         self.finish_production_print("<Compound>")
         self.print_production("<Compound> --> { <Statement List> }")
-        if self.statement_list(): 
+        self.blocks.append('}')
+        node_count = len(self.nodes)
+        if (yield self.statement_list_steps()): 
             if self.token_is('separator', '}'):
+                self.blocks.pop()
+                self.nodes.append(Compound(self.pop_nodes(node_count)))
                 return True
-            else:
-                return False
-        else:
-            return False
+        # Keep the statements parsed before the error
+        self.nodes.append(Incomplete(Compound(self.pop_nodes(node_count))))
+        return False
     else:
         return False
   
@@ -571,30 +857,21 @@ class RDP:
     if self.token_is('identifier'):
       self.finish_production_print("<Assign>")
       self.print_production("<Assign> --> <Identifier> = <Expression> ;")
-      id_tok = self.lexer.get_prev_token()
+      target = self.identifier_node(self.lexer.get_prev_token())
+      value = None
       if self.token_is('operator', '='):
-        if self.expression():
-          assign_tok = self.lexer.get_prev_token()
-          assign_type = assign_tok.type
-          if self.token_is('separator', ';'):
-            # Add POPM instruction to asm_instructions
-            # Get mem address of identifer
-            if not self.is_checking_recursive() and not self.ignore_symbol_table:
-              if assign_type == 'integer' or id_tok.type == 'identifier':
-                if not self.symbol_table.exists_identifier(id_tok):
-                  err_msg = f"Error: Identifier {id_tok.value} was not declared"
-                  self.print_production(err_msg)
-                  self.asm_instructions.append(err_msg)
-                  return False
-                mem_address = self.symbol_table.get_mem_address(id_tok)
-                self.asm_instructions.append(f"POPM {mem_address}")
-            return True
-          else:
-            return False
-        else:
-           return False
-      else:
-        return False
+        node_count = len(self.nodes)
+        is_expression = self.expression()
+        if len(self.nodes) > node_count:
+          value = self.nodes.pop()
+        if is_expression and self.token_is('separator', ';'):
+          self.nodes.append(Assign(target, value))
+          # The target is checked once the statement is parsed
+          if not self.ignore_symbol_table:
+            return self.check_identifier(target.token)
+          return True
+      self.nodes.append(Incomplete(Assign(target, value)))
+      return False
     else:
        return False
 
@@ -602,25 +879,27 @@ class RDP:
     """
     R17. <If> ::= if ( <Condition> ) <Statement> <If_prime>
     """
+    return self.run_steps(self.If_steps())
+
+  def If_steps(self):
+    """Generator with the steps of If for run_steps"""
     if self.token_is('keyword', 'if'):
       self.finish_production_print("<If>")
       self.print_production("<If> --> if ( <Condition> ) <Statement> <If_prime>")
+      self.blocks.append('endif')
+      node_count = len(self.nodes)
       if self.token_is('separator', '('):
         if self.condition():
           if self.token_is('separator', ')'):
-            if self.statement():
-              if self.If_prime():
+            if (yield self.statement_steps()):
+              if (yield self.If_prime_steps()):
+                 self.blocks.pop()
+                 # The condition, the statement, and the else statement if there is one
+                 self.nodes.append(If(*self.pop_nodes(node_count)))
                  return True
-              else:
-                  return False
-            else:
-              return False
-          else:
-            return False
-        else:
-          return False
-      else:
-          return False
+      # Keep the condition and statements parsed before the error
+      self.push_incomplete(If, node_count, 3)
+      return False
     else:
           return False
   
@@ -628,12 +907,16 @@ class RDP:
     """
     R18. <If_prime> ::= endif | else <Statement> endif
     """
+    return self.run_steps(self.If_prime_steps())
+
+  def If_prime_steps(self):
+    """Generator with the steps of If_prime for run_steps"""
     if self.token_is('keyword','endif'):
       self.print_production("<If_prime> --> endif")
       return True
     elif self.token_is('keyword','else'):
       self.print_production("<If_prime> --> else <Statement> endif")
-      if self.statement():
+      if (yield self.statement_steps()):
           if self.token_is('keyword','endif'):
               return True
           else:
@@ -651,33 +934,36 @@ class RDP:
       self.finish_production_print("<Return>")
       self.print_production("<Return> --> return ; | return <Expression> ;")
       if self.token_is('separator', ';'):
+        self.nodes.append(Return())
         return True
-      elif self.expression():
+      node_count = len(self.nodes)
+      if self.expression():
         if self.token_is('separator', ';'):
+          self.nodes.append(Return(self.nodes.pop()))
           return True
-        else:
-          return False
-      else:
-        return False
+      self.push_incomplete(Return, node_count, 1)
+      return False
     
     return False
   
   def Print(self):
     """
     R20. <Print> ::= print ( <Expression>);
+    Identifiers in the expression are checked as they are parsed.
     """
     self.in_print = True
     if self.token_is('keyword', 'print'):
       self.finish_production_print("<Print>")
       self.print_production("<Print> --> print ( <Expression>);")
+      node_count = len(self.nodes)
       if self.token_is('separator', '('):
         if self.expression():
           if self.token_is('separator', ')'):
             if self.token_is('separator', ';'):
-              if not self.is_checking_recursive():
-                self.asm_instructions.append('SOUT')
+              self.nodes.append(Print(self.nodes.pop()))
               self.in_print = False
               return True
+      self.push_incomplete(Print, node_count, 1)
     self.in_print = False
     return False
   
@@ -690,74 +976,47 @@ class RDP:
       self.finish_production_print("<Scan>")
       self.print_production("<Scan> --> scan ( <IDs> );")
       if self.token_is('separator', '('):
+        node_count = len(self.nodes)
         if self.IDs():
-          if not self.is_checking_recursive() and not self.ignore_symbol_table:
-            self.asm_instructions.append("SIN")
-            id_tok = self.lexer.get_prev_token()
-            if not self.symbol_table.exists_identifier(id_tok):
-              err_msg = f"Error: Identifier {id_tok.value} was not declared"
-              self.print_production(err_msg)
-              self.asm_instructions.append(err_msg)
+          # The identifiers before the last one were checked by IDs
+          if not self.ignore_symbol_table:
+            if not self.check_identifier(self.lexer.get_prev_token()):
+              self.nodes.append(Scan(self.pop_nodes(node_count)))
               self.in_scan = False
               return False
-            id_mem_address = self.symbol_table.get_mem_address(id_tok)
-            self.asm_instructions.append(f"POPM {id_mem_address}")
           if self.token_is('separator', ')'):
             if self.token_is('separator', ';'):
+              self.nodes.append(Scan(self.pop_nodes(node_count)))
               self.in_scan = False
               return True
+        # Keep the identifiers parsed before the error
+        self.nodes.append(Incomplete(Scan(self.pop_nodes(node_count))))
     self.in_scan = False
     return False
   
-  def get_prev_label_line_num(self):
-    """
-    Return line number of the most recent label in instructions list
-    """
-    line_count = len(self.asm_instructions)
-    last_label = None
-    for instruction in self.asm_instructions[::-1]:
-      if instruction == 'LABEL':
-        last_label = line_count
-        break
-      line_count -= 1
-    return last_label
-  
-  def update_prev_JUMP0_line_num(self):
-    """
-    Update the previous JUMP0 instruction so that it points to the next line number
-    """
-    # Update last JUMP0 line number to next line number
-    next_line_num = len(self.asm_instructions) + 1
-    line_count = len(self.asm_instructions) - 1
-    while line_count >= 0:
-      curr_instruction = self.asm_instructions[line_count]
-      if curr_instruction == "JUMP0 UNDEFINED":
-        self.asm_instructions[line_count] = f"JUMP0 {next_line_num}"
-        break
-      line_count -= 1
-
-  
   def While(self):
     """
     R22. <While> ::= while ( <Condition> ) <Statement> endwhile
     """
+    return self.run_steps(self.While_steps())
+
+  def While_steps(self):
+    """Generator with the steps of While for run_steps"""
     if self.token_is('keyword', 'while'):
-      if not self.is_checking_recursive():
-        self.finish_production_print("<While>")
-        self.print_production("<While> --> while ( <Condition> ) <Statement> endwhile")
-        self.asm_instructions.append('LABEL')
+      self.finish_production_print("<While>")
+      self.print_production("<While> --> while ( <Condition> ) <Statement> endwhile")
+      self.blocks.append('endwhile')
+      node_count = len(self.nodes)
       if self.token_is('separator', '('):
         if self.condition():
           if self.token_is('separator', ')'):
-            if self.statement():
+            if (yield self.statement_steps()):
               if self.token_is('keyword', 'endwhile'):
-                # Generate instruction to jump back to start of while loop
-                if not self.is_checking_recursive():
-                  label_line_num = self.get_prev_label_line_num()
-                  self.asm_instructions.append(f"JUMP {label_line_num}")
-                  # Update JUMP0 line number
-                  self.update_prev_JUMP0_line_num()
+                self.blocks.pop()
+                self.nodes.append(While(*self.pop_nodes(node_count)))
                 return True
+      # Keep the condition and statement parsed before the error
+      self.push_incomplete(While, node_count, 2)
     return False
 
   def condition(self):
@@ -774,30 +1033,22 @@ class RDP:
       if next_token.type in FIRST_TYPES or next_token.value in FIRST:
         self.print_production("<Condition> --> <Expression> <Relop> <Expression>")
 
-    # Parse tokens
+    # Parse tokens. Each expression is checked if it ends with an identifier.
+    node_count = len(self.nodes)
+    operator = None
     if self.expression():
-      tok = self.lexer.get_prev_token()
-      if tok.type == 'identifier':
-        if not self.symbol_table.exists_identifier(tok):
-          err_msg = f"Error: Identifier {tok.value} was not declared"
-          self.print_production(err_msg)
-          self.asm_instructions.append(err_msg)
-          return False
-        self.insert_PUSHM()
-      if self.relop():
-        if self.expression():
-          tok = self.lexer.get_prev_token()
-          if tok.type == 'identifier':
-            if not self.symbol_table.exists_identifier(tok):
-              err_msg = f"Error: Identifier {tok.value} was not declared"
-              self.print_production(err_msg)
-              self.asm_instructions.append(err_msg)
-              return False
-            self.insert_PUSHM()
-          self.swap_last_two_instructions()
-          if not self.is_checking_recursive():
-            self.asm_instructions.append('JUMP0 UNDEFINED')
-          return True
+      if self.check_identifier(self.lexer.get_prev_token()):
+        if self.relop():
+          operator = self.lexer.get_prev_token().value
+          if self.expression():
+            if self.check_identifier(self.lexer.get_prev_token()):
+              right = self.nodes.pop()
+              left = self.nodes.pop()
+              self.nodes.append(Condition(left, operator, right))
+              return True
+    # Keep the expressions parsed before the error
+    parts = self.pop_nodes(node_count) + [None, None]
+    self.nodes.append(Incomplete(Condition(parts[0], operator, parts[1])))
     return False
 
   def relop(self):
@@ -808,23 +1059,6 @@ class RDP:
     next_token = self.lexer.peek_next_token()
     if self.token_is('operator') and next_token.value in operators:
       self.print_production(f"<Relop> --> {next_token.value}")
-      if not self.is_checking_recursive():
-        # Get operator value
-        op = self.lexer.get_prev_token().value
-
-        # Insert LES instruction for < operator
-        if op == '<':
-          self.asm_instructions.append('LES')
-        elif op == '>':
-          self.asm_instructions.append('GRT')
-        elif op == '==':
-          self.asm_instructions.append('EQU')
-        elif op == '!=':
-          self.asm_instructions.append('NEQ')
-        elif op == '=>':
-          self.asm_instructions.append('GEQ')
-        elif op == '<=':
-          self.asm_instructions.append('LEQ')
       return True
     else:
       self.lexer.backtrack()
@@ -834,132 +1068,170 @@ class RDP:
     """
     R25. <Expression> ::= <Term> <Expression_prime>
     """
-    self.print_production("<Expression> --> <Term> <Expression_prime>")
-    if self.term():
-      if self.expression_prime():
-        return True
-    return False
-  
-  def insert_id_pushm_second(self):
-    """
-    Insert a PUSHM instruction for identifiers when the identifier is
-    the first of two primaries
-    """
-    if self.in_print:
-      return
-    tok = self.lexer.tokens[self.lexer.curr_token - 2]
-    if tok and tok.type == 'identifier':
-      if not self.symbol_table.exists_identifier(tok):
-        err_msg = f"Error: Identifier {tok.value} was not declared"
-        self.print_production(err_msg)
-        self.asm_instructions.append(err_msg)
-        return False
-      mem_address = self.symbol_table.get_mem_address(tok)
-      self.asm_instructions.append(f"PUSHM {mem_address}")
+    return self.parse_expression(EXPRESSION)
 
-  def insert_id_pushm_first(self):
-    """
-    Insert PUSHM instruction when identifier is previous token
-    """
-    if self.in_print:
-      return
-    tok = self.lexer.get_prev_token()
-    if tok and tok.type == 'identifier':
-      if not self.symbol_table.exists_identifier(tok):
-        err_msg = f"Error: Identifier {tok.value} was not declared"
-        self.print_production(err_msg)
-        self.asm_instructions.append(err_msg)
-        return False
-      mem_address = self.symbol_table.get_mem_address(tok)
-      self.asm_instructions.append(f'PUSHM {mem_address}')
+  def parse_expression(self, rule):
+    """
+    Parse the expression rule rule (EXPRESSION, EXPRESSION_PRIME, TERM,
+    TERM_PRIME, or FACTOR) and return True if it was parsed, False otherwise.
+    R25-R29 are parsed in one loop by precedence climbing: the rules an
+    operand or operator is nested in are kept on a stack, with the node
+    they build once the nested rule is parsed. Operators are left
+    associative, so an operator node is built as soon as its right operand
+    is parsed, before the rest of <Term_prime> or <Expression_prime>.
+    Outside of print statements, an identifier is checked each time it is
+    the last token before an operator, or the last token of the right
+    operand of an operator (of the whole <Term_prime> for * and /). If the
+    expression does not parse, what was parsed of it is pushed as an
+    Incomplete node.
+    """
+    lexer = self.lexer
+    peek_next_token = lexer.peek_next_token
+    nodes = self.nodes
+    check_operands = not (self.ignore_symbol_table or self.in_print)
+    operator_kind = TOKEN_KINDS['operator']
+    print_production = self.print_production
+    print_token = self.print_token
+    if self.trace is None:
+      # Nothing is printed or saved, so do not format productions and tokens
+      print_production = print_token = lambda line: None
+    # What to do when the rule being parsed is parsed
+    stack = [PARSED]
+    while True:
+      if rule == EXPRESSION:
+        print_production("<Expression> --> <Term> <Expression_prime>")
+        stack.append(EXPRESSION_PRIME)
+        rule = TERM
+      elif rule == TERM:
+        print_production("<Term> --> <Factor> <Term_prime>")
+        stack.append(TERM_PRIME)
+        rule = FACTOR
+      elif rule == FACTOR:
+        token = peek_next_token()
+        if token is not None and token.kind == operator_kind and token.value == '-':
+          print_token(lexer.get_next_token())
+          print_production('<Factor> --> - <Primary>')
+          stack.append(NEGATE)
+          token = peek_next_token()
+        else:
+          print_production('<Factor> --> <Primary>')
+        if token is not None and token.value == '(' and token.type == 'separator':
+          # <Primary> --> ( <Expression> )
+          print_token(lexer.get_next_token())
+          print_production('<Primary> --> ( <Expression> )')
+          stack.append(CLOSE_PARENTHESIS)
+          rule = EXPRESSION
+          continue
+        node_count = len(nodes)
+        if not self.primary():
+          # A primary that does not parse only pushes an identifier that was
+          # not declared
+          partial = Incomplete(nodes.pop()) if len(nodes) > node_count else None
+          return self.incomplete_expression(stack, partial)
+        rule = PARSED
+      elif rule == TERM_PRIME:
+        token = peek_next_token()
+        if token is not None and token.kind == operator_kind and token.value in ('*', '/'):
+          prev_token = lexer.get_prev_token()
+          print_token(lexer.get_next_token())
+          print_production(f"<Term_prime> --> {token.value} <Factor> <Term_prime>")
+          if check_operands:
+            self.check_identifier(prev_token)
+          stack.append(CHECK_LAST_OPERAND)
+          stack.append(TERM_PRIME)
+          stack.append(MULTIPLY if token.value == '*' else DIVIDE)
+          rule = FACTOR
+        else:
+          print_production('<Term_prime> --> <Empty>')
+          rule = PARSED
+      elif rule == EXPRESSION_PRIME:
+        token = peek_next_token()
+        if token is not None and token.kind == operator_kind and token.value in ('+', '-'):
+          prev_token = lexer.get_prev_token()
+          print_token(lexer.get_next_token())
+          print_production(f"<Expression_prime> --> {token.value} <Term> <Expression_prime>")
+          if check_operands:
+            self.check_identifier(prev_token)
+          stack.append(EXPRESSION_PRIME)
+          stack.append(ADD if token.value == '+' else SUBTRACT)
+          rule = TERM
+        else:
+          print_production("<Expression_prime> --> <Empty>")
+          rule = PARSED
+      else:
+        # The rule was parsed, continue the rule it is nested in
+        rule = stack.pop()
+        if rule == PARSED:
+          return True
+        elif rule == NEGATE:
+          nodes[-1] = Negate(nodes[-1])
+          rule = PARSED
+        elif rule == CLOSE_PARENTHESIS:
+          if not self.token_is('separator', ')'):
+            return self.incomplete_expression(stack, Incomplete(Parenthesized(nodes.pop())))
+          nodes[-1] = Parenthesized(nodes[-1])
+          rule = PARSED
+        elif rule == CHECK_LAST_OPERAND:
+          if check_operands:
+            self.check_identifier(lexer.get_prev_token())
+          rule = PARSED
+        elif rule in BINARY_OPERATORS:
+          # The right operand of a binary operator was parsed
+          right = nodes.pop()
+          left = nodes.pop() if nodes else None
+          nodes.append(BinaryOp(BINARY_OPERATORS[rule], left, right))
+          if check_operands and (rule == ADD or rule == SUBTRACT):
+            self.check_identifier(lexer.get_prev_token())
+          rule = PARSED
+
+  def incomplete_expression(self, stack, partial):
+    """
+    Push what was parsed of an expression that failed to parse, and return
+    False. stack is the stack of parse_expression when it failed, and
+    partial is the Incomplete node of the innermost rule that failed, or
+    None if nothing was parsed of it.
+    """
+    nodes = self.nodes
+    while stack:
+      rule = stack.pop()
+      if rule == NEGATE:
+        if partial is not None:
+          partial = Incomplete(Negate(partial))
+      elif rule == CLOSE_PARENTHESIS:
+        if partial is not None:
+          partial = Incomplete(Parenthesized(partial))
+      elif rule in BINARY_OPERATORS:
+        left = nodes.pop() if nodes else None
+        partial = Incomplete(BinaryOp(BINARY_OPERATORS[rule], left, partial))
+    if partial is not None:
+      nodes.append(partial)
+    return False
 
   def expression_prime(self):
     """
     R26. <Expression_prime> ::= + <Term> <Expression_prime> | - <Term> <Expression_prime> | <Empty>
+    The left operand of the first operator is the last node pushed, if any.
     """
-    if self.token_is('operator', '+'):
-      self.print_production("<Expression_prime> --> + <Term> <Expression_prime>")
-      if not self.is_checking_recursive() and not self.ignore_symbol_table:
-        self.insert_id_pushm_second()
-        self.asm_instructions.append('A')
-      if self.term():
-        if not self.is_checking_recursive() and not self.ignore_symbol_table:
-          self.insert_id_pushm_first()
-          self.swap_last_two_instructions()
-        if self.expression_prime():
-          return True
-      return False
-    elif self.token_is('operator', '-'):
-      self.print_production("<Expression_prime> --> - <Term> <Expression_prime>")
-      if not self.is_checking_recursive() and not self.ignore_symbol_table:
-        self.insert_id_pushm_second()
-      if self.term():
-        if not self.is_checking_recursive() and not self.ignore_symbol_table:
-          self.insert_id_pushm_first()
-        if self.expression_prime():
-          if not self.is_checking_recursive() and not self.ignore_symbol_table:
-            self.asm_instructions.append('S')
-          return True
-      return False
-    elif self.empty():
-      self.print_production("<Expression_prime> --> <Empty>")
-      return True
-    return False
+    return self.parse_expression(EXPRESSION_PRIME)
   
   def term(self):
     """
     R27. <Term> ::= <Factor> <Term_prime>
     """
-    self.print_production("<Term> --> <Factor> <Term_prime>")
-    if self.factor():
-      if self.term_prime():
-        return True
-    return False
+    return self.parse_expression(TERM)
   
   def term_prime(self):
     """
     R28. <Term_prime> ::= * <Factor> <Term_prime> | / <Factor> <Term_prime> | <Empty>
+    The left operand of the first operator is the last node pushed, if any.
     """
-    if self.token_is('operator', '*'):
-      self.print_production("<Term_prime> --> * <Factor> <Term_prime>")
-      if not self.is_checking_recursive() and not self.ignore_symbol_table:
-        self.insert_id_pushm_second()
-      if self.factor():
-        if self.term_prime():
-          if not self.is_checking_recursive() and not self.ignore_symbol_table:
-            self.insert_id_pushm_first()
-            self.asm_instructions.append('M')
-          return True
-      return False
-    elif self.token_is('operator', '/'):
-      self.print_production('<Term_prime> --> / <Factor> <Term_prime>')
-      if not self.is_checking_recursive() and not self.ignore_symbol_table:
-        self.insert_id_pushm_second()
-      if self.factor():
-        if self.term_prime():
-          if not self.is_checking_recursive() and not self.ignore_symbol_table:
-            self.insert_id_pushm_first()
-            self.asm_instructions.append('D')
-          return True
-      return False
-    elif self.empty():
-      self.print_production('<Term_prime> --> <Empty>')
-      return True
-    return False
+    return self.parse_expression(TERM_PRIME)
   
   def factor(self):
     """
     R29. <Factor> ::= - <Primary> | <Primary>
     """
-    if self.token_is('operator', '-'):
-      self.print_production('<Factor> --> - <Primary>')
-      if self.primary():
-        return True
-    else:
-      self.print_production('<Factor> --> <Primary>')
-      if self.primary():
-        return True
-    return False
+    return self.parse_expression(FACTOR)
   
   def primary(self):
     """
@@ -967,30 +1239,26 @@ class RDP:
     ( <Expression> ) | <Real> | true | false
     """
     if self.token_is('identifier'):
+      id_tok = self.lexer.get_prev_token()
       if self.token_is('separator', '('):
         self.print_production('<Primary> --> <Identifier> ( <IDs> )')
+        node_count = len(self.nodes)
         if self.IDs():
           if self.token_is('separator', ')'):
+            self.nodes.append(Call(id_tok.value, self.pop_nodes(node_count)))
             return True
+        # Drop the nodes of the arguments parsed before the error
+        del self.nodes[node_count:]
         return False
       else:      
         self.print_production('<Primary> --> <Identifier>')
-        if not self.is_checking_recursive() and not self.ignore_symbol_table and self.in_print:
-          prev_tok = self.lexer.get_prev_token()
-          if not self.symbol_table.exists_identifier(prev_tok):
-            err_msg = f"Error: Identifier {prev_tok.value} was not declared"
-            self.print_production(err_msg)
-            self.asm_instructions.append(err_msg)
-            return False
-          mem_address = self.symbol_table.get_mem_address(prev_tok)
-          self.asm_instructions.append(f"PUSHM {mem_address}")
+        self.nodes.append(self.identifier_node(id_tok))
+        if self.in_print and not self.ignore_symbol_table:
+          return self.check_identifier(id_tok)
         return True
     elif self.token_is('integer'):
       self.print_production('<Primary> --> <Integer>')
-      int_tok = self.lexer.get_prev_token()
-      if int_tok and not self.is_checking_recursive():
-        int_val = int_tok.value
-        self.asm_instructions.append(f"PUSHI {int_val}")
+      self.nodes.append(Integer(self.lexer.get_prev_token().value))
       return True
     elif self.token_is('separator', '('):
       self.print_production('<Primary> --> ( <Expression> )')
@@ -1000,16 +1268,15 @@ class RDP:
       return False
     elif self.token_is('real'):
       self.print_production('<Primary> --> <Real>')
+      self.nodes.append(Real(self.lexer.get_prev_token().value))
       return True
     elif self.token_is('keyword', 'true'):
       self.print_production('<Primary> --> true')
-      if not self.is_checking_recursive():
-        self.asm_instructions.append('PUSHI 1')
+      self.nodes.append(Boolean(True))
       return True
     elif self.token_is('keyword', 'false'):
       self.print_production('<Primary> --> false')
-      if not self.is_checking_recursive():
-        self.asm_instructions.append("PUSHI 0")
+      self.nodes.append(Boolean(False))
       return True
     return False
   
@@ -0,0 +1,123 @@
+"""Syntax tree built by the recursive descent parser for code generation"""
+from dataclasses import dataclass, field
+
+# Nodes use __slots__ so a tree of a long program stays compact
+
+@dataclass(slots=True)
+class Program:
+  """<Rat24S>: the function definitions and the statements of the program"""
+  functions: list
+  statements: list
+
+@dataclass(slots=True)
+class Function:
+  """<Function>: name of the function and the statements of its body"""
+  name: str
+  body: list
+
+@dataclass(slots=True)
+class Compound:
+  """<Compound>: statements between { and }"""
+  statements: list
+
+@dataclass(slots=True)
+class Assign:
+  """<Assign>: Identifier target = value"""
+  target: object
+  value: object
+
+@dataclass(slots=True)
+class If:
+  """<If>: statements then and otherwise, where otherwise is None without else"""
+  condition: object
+  then: object
+  otherwise: object = None
+
+@dataclass(slots=True)
+class Return:
+  """<Return>: value is None for return ;"""
+  value: object = None
+
+@dataclass(slots=True)
+class Print:
+  """<Print>: expression value that is printed"""
+  value: object
+
+@dataclass(slots=True)
+class Scan:
+  """<Scan>: list of Identifier nodes that are read"""
+  targets: list
+
+@dataclass(slots=True)
+class While:
+  """<While>: condition and statement body"""
+  condition: object
+  body: object
+
+@dataclass(slots=True)
+class Condition:
+  """<Condition>: left operator right, where operator is a relop lexeme"""
+  left: object
+  operator: str
+  right: object
+
+@dataclass(slots=True)
+class BinaryOp:
+  """
+  left operator right, where operator is +, -, *, or /. left is None if
+  <Expression_prime> or <Term_prime> was parsed without a left operand.
+  """
+  operator: str
+  left: object
+  right: object
+
+@dataclass(slots=True)
+class Negate:
+  """- operand"""
+  operand: object
+
+@dataclass(slots=True)
+class Parenthesized:
+  """( value ): expression in parentheses"""
+  value: object
+
+@dataclass(slots=True)
+class Identifier:
+  """
+  Identifier with its token. address is its memory address in the symbol
+  table, and error is the error message if it was not declared. Both are
+  None if it was not looked up.
+  """
+  name: str
+  token: object = field(default=None, compare=False, repr=False)
+  address: int = None
+  error: str = None
+
+@dataclass(slots=True)
+class Integer:
+  """Integer literal, value is its lexeme"""
+  value: str
+
+@dataclass(slots=True)
+class Real:
+  """Real literal, value is its lexeme"""
+  value: str
+
+@dataclass(slots=True)
+class Boolean:
+  """true or false"""
+  value: bool
+
+@dataclass(slots=True)
+class Call:
+  """<Identifier> ( <IDs> ): name of the function and Identifier arguments"""
+  name: str
+  arguments: list
+
+@dataclass(slots=True)
+class Incomplete:
+  """
+  Production that failed to parse. node is the node of the production
+  with what was parsed of it, and None for the parts that were not parsed.
+  """
+  node: object
@@ -1,11 +1,24 @@
+import contextlib
+import io
 import os
+import pickle
+import sys
+import tempfile
 import unittest
 
 from compiler import main
+from fsm import FSM
 from lexer import Lexer
-from parse_token import Token
+from parse_token import Token, TokenKind
 from rdp import RDP
 from sym_table import Symbol, SymbolTable
+from syntax_tree import (Assign, BinaryOp, Call, Compound, Condition, Function,
+                         Identifier, Integer, Print, Program, Return, While)
+from token_cache import TokenCache, read_token_file, write_token_file
+from token_stream import TokenStream, split_source
+from trace_reader import render_trace
+from trace_writer import StructuredTraceWriter, TraceWriter, read_trace
+import utils
 
 class TestToken(unittest.TestCase):
     """Test Token class"""
@@ -41,13 +54,81 @@ class TestToken(unittest.TestCase):
         tok = Token('identifier', upper_val)
         self.assertEqual(tok.value, lower_val)
 
+    def test_kind(self):
+        """Test that tokens store their type as a TokenKind"""
+        tok = Token('keyword', 'while')
+        self.assertEqual(tok.kind, TokenKind.KEYWORD)
+        self.assertEqual(tok.type, 'keyword')
+        self.assertFalse(hasattr(tok, '__dict__'))
+
+    def test_frozen(self):
+        """Test that tokens cannot be changed once created"""
+        tok = Token('identifier', 'x')
+        with self.assertRaises(AttributeError):
+            tok.value = 'y'
+
+    def test_interned_values(self):
+        """Test that identifier and keyword values are interned"""
+        tok = Token('identifier', 'My_' + 'Long_Identifier_Name')
+        tok2 = Token('identifier', 'my_long_' + 'identifier_name'.upper())
+        self.assertIs(tok.value, tok2.value)
+
+    def test_pickle(self):
+        """Test that tokens can be pickled"""
+        tok = Token('real', '3.14')
+        self.assertEqual(pickle.loads(pickle.dumps(tok)), tok)
+
+class TestFSM(unittest.TestCase):
+    """Test the compiled finite-state machines"""
+
+    def test_identifier(self):
+        """Test that only identifiers are accepted by is_identifier"""
+        fsm = FSM()
+        for w in ['a', 'abc123', 'testIdentifier', 'variable_1']:
+            self.assertTrue(fsm.is_identifier(w), w)
+        for w in ['', '1abc', '_abc', 'ab-c', 'caf\u00e9']:
+            self.assertFalse(fsm.is_identifier(w), w)
+
+    def test_integer(self):
+        """Test that only integers are accepted by is_integer"""
+        fsm = FSM()
+        for w in ['7', '153', '1849375932']:
+            self.assertTrue(fsm.is_integer(w), w)
+        for w in ['', '3.14', '12a', '\u0663']:
+            self.assertFalse(fsm.is_integer(w), w)
+
+    def test_real(self):
+        """Test that only reals are accepted by is_real"""
+        fsm = FSM()
+        for w in ['3.14', '22.5', '0.99', '25.0']:
+            self.assertTrue(fsm.is_real(w), w)
+        for w in ['', '26.', '.009', '1.2.3', '12']:
+            self.assertFalse(fsm.is_real(w), w)
+
+    def test_classify(self):
+        """Test that the product FSM agrees with the identifier, integer, and real FSMs"""
+        fsm = FSM()
+        words = ['abc123', 'variable_1', '7', '153', '3.14', '0.99', '26.',
+                 '.009', '1.2.3', '12abc', '_abc', 'a.b', '', 'caf\u00e9']
+        for w in words:
+            if fsm.is_identifier(w):
+                expected_type = 'identifier'
+            elif fsm.is_integer(w):
+                expected_type = 'integer'
+            elif fsm.is_real(w):
+                expected_type = 'real'
+            else:
+                expected_type = 'illegal'
+            self.assertEqual(fsm.classify(w), expected_type, w)
+
 class TestLexer(unittest.TestCase):
     """Test that lexer works"""
+    scanner = 'regex'
 
     def test_get_next_token(self):
         """Test that get_next_token returns one token at a time"""
         source_code = "$function convertx (fahr integer)"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
 
         res = []
@@ -61,16 +142,31 @@ class TestLexer(unittest.TestCase):
     def test_comments(self):
         """Test that comments are removed and not tokenized"""
         source_code = "[* This is a one line comment *]"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
 
         token_count = len(tokens)
         self.assertEqual(token_count, 0)
 
+    def test_comment_offsets(self):
+        """Test that skipped comments do not shift the positions of later tokens"""
+        source_code = "a[* one\ntwo *]b [**] c"
+        l = Lexer(source_code, scanner=self.scanner)
+        positions = [(tok.value, tok.line, tok.column, tok.offset) for tok in l.tokens]
+        self.assertEqual(positions, [('a', 1, 1, 0), ('b', 2, 7, 14), ('c', 2, 14, 21)])
+        self.assertEqual(l.errors, [])
+
+    def test_unterminated_comment(self):
+        """Test that an unterminated comment is reported with its start position"""
+        source_code = "x\n  y [* not closed\nz"
+        l = Lexer(source_code, scanner=self.scanner)
+        self.assertEqual(l.tokens, [Token('identifier', 'x'), Token('identifier', 'y')])
+        self.assertEqual(l.errors, ["Error: Unterminated comment (line 2, column 5)"])
+
     def test_keywords(self):
         """Test that keywords are tokenized as keywords"""
         source_code = "boolean         else            endif"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [Token(type='keyword', value='boolean'), Token(type='keyword', value='else'), Token(type='keyword', value='endif')]
 
@@ -79,7 +175,7 @@ class TestLexer(unittest.TestCase):
     def test_separators(self):
         """Test that separators are tokenized as separators"""
         source_code = "(){},;$"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [
                 Token(type='separator', value='('), Token(type='separator', value=')'), Token(type='separator', value='{'), Token(type='separator', value='}'),
@@ -91,7 +187,7 @@ class TestLexer(unittest.TestCase):
     def test_operators(self):
         """Test that operators are tokenized as operators"""
         source_code = "+ - * / == != > < <= => ="
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [
                 Token(type='operator', value='+'), Token(type='operator', value='-'), Token(type='operator', value='*'), Token(type='operator', value='/'),
@@ -104,7 +200,7 @@ class TestLexer(unittest.TestCase):
     def test_identifiers(self):
         """Test that identifiers are tokenized as identifiers"""
         source_code = "abc123 testIdentifier variable_1"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [Token(type='identifier', value='abc123'), Token(type='identifier', value='testidentifier'), Token(type='identifier', value='variable_1')]
 
@@ -113,7 +209,7 @@ class TestLexer(unittest.TestCase):
     def test_integers(self):
         """Test that integers are tokenized as integers"""
         source_code = "7 153 1849375932"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [Token(type='integer', value='7'), Token(type='integer', value='153'), Token(type='integer', value='1849375932')]
 
@@ -122,7 +218,7 @@ class TestLexer(unittest.TestCase):
     def test_reals(self):
         """Test that reals are tokenized as reals"""
         source_code = "3.14 22.5 0.99 25.0 26. .009"
-        l = Lexer(source_code)
+        l = Lexer(source_code, scanner=self.scanner)
         tokens = l.tokenize()
         expected_tokens = [
                 Token(type='real', value='3.14'), Token(type='real', value='22.5'), Token(type='real', value='0.99'), Token(type='real', value='25.0'),
@@ -130,7 +226,475 @@ class TestLexer(unittest.TestCase):
             ]
 
         self.assertEqual(tokens, expected_tokens)
-        
+
+    def test_positions(self):
+        """Test that tokens record their line, column, and offset"""
+        source_code = "$\n  abc = 12;\r\nwhile"
+        l = Lexer(source_code, scanner=self.scanner)
+        positions = [(tok.line, tok.column, tok.offset) for tok in l.tokens]
+        expected_positions = [(1, 1, 0), (2, 3, 4), (2, 7, 8), (2, 9, 10), (2, 11, 12), (3, 1, 15)]
+        self.assertEqual(positions, expected_positions)
+
+    def test_print_tokens(self):
+        """Test that tokens are printed on the same lines as in the source code"""
+        source_code = "$\n\n  abc = 12;\nwhile"
+        l = Lexer(source_code, scanner=self.scanner)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            l.print_tokens()
+        lines = output.getvalue().split('\n')
+        expected_lines = [
+            "<separator='$'> ",
+            "<identifier='abc'> <operator='='> <integer='12'> <separator=';'> ",
+            "<keyword='while'> ",
+        ]
+        self.assertEqual(lines[1:4], expected_lines)
+
+    def test_scanners_match(self):
+        """Test that every scanner returns the same tokens for the sample programs"""
+        for filename in sorted(os.listdir('RAT24S_programs')):
+            with open(os.path.join('RAT24S_programs', filename), encoding='utf-8-sig') as source_file:
+                source_code = source_file.read()
+            expected_tokens = Lexer(source_code, scanner='split').tokens
+            tokens = Lexer(source_code, scanner=self.scanner).tokens
+            self.assertEqual(tokens, expected_tokens, filename)
+
+class TestLexerSplitScanner(TestLexer):
+    """Run the lexer tests with the original re.split and FSM scanner"""
+    scanner = 'split'
+
+class TestStreamingLexer(unittest.TestCase):
+    """Test that the streaming lexer returns the same tokens as the lexer"""
+
+    def test_sample_programs(self):
+        """Test every sample program with chunks that split tokens and comments"""
+        for filename in sorted(os.listdir('RAT24S_programs')):
+            path = os.path.join('RAT24S_programs', filename)
+            with open(path, encoding='utf-8-sig') as source_file:
+                expected_tokens = Lexer(source_file.read()).tokens
+            for chunk_size in [1, 2, 3, 7, 4096]:
+                with open(path, encoding='utf-8-sig') as source_file:
+                    tokens = list(Lexer.stream_tokens(source_file, chunk_size=chunk_size))
+                self.assertEqual(tokens, expected_tokens, f"{filename} chunk_size={chunk_size}")
+
+    def test_positions(self):
+        """Test that streamed tokens have the same positions as the lexer's tokens"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            expected_tokens = Lexer(source_file.read()).tokens
+        expected_positions = [(tok.line, tok.column, tok.offset) for tok in expected_tokens]
+        for chunk_size in [1, 5, 4096]:
+            with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+                tokens = list(Lexer.stream_tokens(source_file, chunk_size=chunk_size))
+            positions = [(tok.line, tok.column, tok.offset) for tok in tokens]
+            self.assertEqual(positions, expected_positions, f"chunk_size={chunk_size}")
+
+    def test_straddling_operators(self):
+        """Test that multi-character operators split across chunks are one token"""
+        source_code = "a<=b==c=>d!=e"
+        expected_tokens = Lexer(source_code).tokens
+        for chunk_size in range(1, len(source_code) + 1):
+            tokens = list(Lexer.stream_tokens(io.StringIO(source_code), chunk_size=chunk_size))
+            self.assertEqual(tokens, expected_tokens, f"chunk_size={chunk_size}")
+
+    def test_straddling_comments(self):
+        """Test that comments split across chunks are skipped"""
+        source_code = "x [* a comment * ] [ with *] y[**]z"
+        expected_tokens = [Token('identifier', 'x'), Token('identifier', 'y'), Token('identifier', 'z')]
+        for chunk_size in range(1, len(source_code) + 1):
+            tokens = list(Lexer.stream_tokens(io.StringIO(source_code), chunk_size=chunk_size))
+            self.assertEqual(tokens, expected_tokens, f"chunk_size={chunk_size}")
+
+    def test_straddling_whitespace(self):
+        """Test that whitespace running across chunks keeps the positions of the tokens after it"""
+        source_code = "a" + " \n\t " * 50 + "b  \n  c"
+        expected_tokens = Lexer(source_code).tokens
+        expected_positions = [(tok.line, tok.column, tok.offset) for tok in expected_tokens]
+        for chunk_size in range(1, 12):
+            tokens = list(Lexer.stream_tokens(io.StringIO(source_code), chunk_size=chunk_size))
+            self.assertEqual(tokens, expected_tokens, f"chunk_size={chunk_size}")
+            positions = [(tok.line, tok.column, tok.offset) for tok in tokens]
+            self.assertEqual(positions, expected_positions, f"chunk_size={chunk_size}")
+
+    def test_unterminated_comment(self):
+        """Test that an unterminated comment runs to the end of the file and is reported"""
+        source_code = "x [* not closed y"
+        errors = []
+        tokens = list(Lexer.stream_tokens(io.StringIO(source_code), chunk_size=4, errors=errors))
+        self.assertEqual(tokens, [Token('identifier', 'x')])
+        self.assertEqual(errors, ["Error: Unterminated comment (line 1, column 3)"])
+
+class TestLazyLexer(unittest.TestCase):
+    """Test the on-demand lexer"""
+
+    def test_same_tokens(self):
+        """Test that tokens read on demand are the same as the lexer's tokens"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+        expected_tokens = Lexer(source_code).tokens
+        l = Lexer(source_code, lazy=True)
+        tokens = []
+        while l.peek_next_token() is not None:
+            tokens.append(l.get_next_token())
+        self.assertEqual(tokens, expected_tokens)
+
+    def test_tokenizes_on_demand(self):
+        """Test that only the tokens the parser has looked at are tokenized"""
+        source_code = "$ $ $ x = 1; " * 1000
+        l = Lexer(source_code, lazy=True)
+        parser = RDP(l)
+        self.assertFalse(parser.rat24s())
+        self.assertLess(len(l.tokens.buffer), 20)
+
+    def test_window(self):
+        """Test that tokens outside the window are dropped"""
+        l = Lexer("a b c d e f g h i j", lazy=True, window=2)
+        for i in range(8):
+            l.get_next_token()
+        self.assertEqual(l.get_prev_token(), Token('identifier', 'h'))
+        l.backtrack()
+        self.assertEqual(l.get_next_token(), Token('identifier', 'h'))
+        with self.assertRaises(IndexError):
+            l.tokens[0]
+
+    def test_rdp(self):
+        """Test that RDP generates the same instructions from a lazy lexer"""
+        path = "RAT24S_programs/program_1.txt"
+        l = Lexer.from_file(path, lazy=True)
+        parser = RDP(l)
+        self.assertTrue(parser.rat24s())
+        l.close()
+        with open(path, encoding='utf-8-sig') as source_file:
+            expected_parser = RDP(Lexer(source_file.read()))
+        expected_parser.rat24s()
+        self.assertEqual(parser.asm_instructions, expected_parser.asm_instructions)
+
+class TestIncrementalLexer(unittest.TestCase):
+    """Test that editing the source code gives the same tokens as tokenizing it again"""
+
+    def assertSameTokens(self, lexer):
+        """Assert that lexer has the tokens, positions, and errors of a new Lexer"""
+        expected = Lexer(lexer.sourceCode)
+        positions = [(tok.type, tok.value, tok.line, tok.column, tok.offset) for tok in lexer.tokens]
+        expected_positions = [(tok.type, tok.value, tok.line, tok.column, tok.offset) for tok in expected.tokens]
+        self.assertEqual(positions, expected_positions)
+        self.assertEqual(lexer.errors, expected.errors)
+
+    def test_edit_identifier(self):
+        """Test that renaming an identifier only re-lexes the tokens around it"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+        l = Lexer(source_code)
+        token_count = len(l.tokens)
+        start = source_code.index('var3')
+        first, old_end, new_end = l.edit(start, start + 4, 'total\n')
+        self.assertSameTokens(l)
+        self.assertEqual(len(l.tokens), token_count)
+        self.assertLessEqual(new_end - first, 4)
+        self.assertEqual(old_end - first, new_end - first)
+
+    def test_edit_comment(self):
+        """Test that opening and closing a comment re-lexes the tokens it covers"""
+        l = Lexer("a = b;\nc = d *] e;\nf;")
+        self.assertEqual(l.edit(7, 7, '[*'), (2, 9, 4))
+        self.assertEqual([tok.value for tok in l.tokens], ['a', '=', 'b', ';', 'e', ';', 'f', ';'])
+        self.assertSameTokens(l)
+        l.edit(7, 9, '')
+        self.assertSameTokens(l)
+
+    def test_edit_lookahead(self):
+        """Test that a token is re-lexed when the character after the next one changes"""
+        l = Lexer("while!=x")
+        l.edit(6, 7, '{')
+        self.assertEqual(l.tokens, [Token('illegal', 'while!'), Token('separator', '{'), Token('identifier', 'x')])
+        self.assertSameTokens(l)
+
+    def test_edit_unterminated_comment(self):
+        """Test that closing an unterminated comment lexes the rest of the source code"""
+        l = Lexer("a [* b\nc d")
+        self.assertEqual(l.errors, ["Error: Unterminated comment (line 1, column 3)"])
+        l.edit(8, 8, '*]')
+        self.assertEqual(l.tokens, [Token('identifier', 'a'), Token('identifier', 'd')])
+        self.assertSameTokens(l)
+
+    def test_edit_lazy(self):
+        """Test that a lazy Lexer cannot be edited"""
+        l = Lexer("a b", lazy=True)
+        with self.assertRaises(ValueError):
+            l.edit(0, 1, 'c')
+
+class TestMappedLexer(unittest.TestCase):
+    """Test the memory-mapped lexer"""
+
+    def test_sample_programs(self):
+        """Test that every sample program has the same tokens as the lexer"""
+        for filename in sorted(os.listdir('RAT24S_programs')):
+            path = os.path.join('RAT24S_programs', filename)
+            with open(path, encoding='utf-8-sig') as source_file:
+                expected_tokens = Lexer(source_file.read()).tokens
+            l = Lexer.from_mmap(path)
+            try:
+                self.assertEqual(l.tokens, expected_tokens, filename)
+            finally:
+                l.close()
+
+    def test_lazy_value(self):
+        """Test that token values are only decoded when they are read"""
+        l = Lexer.from_mmap("RAT24S_programs/print_true.source")
+        try:
+            tok = l.tokens[3]
+            self.assertEqual((tok.offset, tok.length), (9, 5))
+            self.assertIsNone(tok._value)
+            self.assertEqual(tok.value, 'print')
+            self.assertEqual(tok, Token('keyword', 'print'))
+        finally:
+            l.close()
+
+class TestTokenStream(unittest.TestCase):
+    """Test the column-oriented token store"""
+
+    def test_sample_programs(self):
+        """Test that every sample program has the same tokens as the lexer"""
+        for filename in sorted(os.listdir('RAT24S_programs')):
+            with open(os.path.join('RAT24S_programs', filename), encoding='utf-8-sig') as source_file:
+                source_code = source_file.read()
+            stream = TokenStream.from_source(source_code)
+            self.assertEqual(list(stream), Lexer(source_code).tokens, filename)
+
+    def test_positions(self):
+        """Test that tokens have the same positions as the lexer's tokens"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+        expected_positions = [(tok.line, tok.column, tok.offset) for tok in Lexer(source_code).tokens]
+        positions = [(tok.line, tok.column, tok.offset) for tok in TokenStream.from_source(source_code)]
+        self.assertEqual(positions, expected_positions)
+
+    def test_interned_lexemes(self):
+        """Test that repeated lexemes are only stored once"""
+        stream = TokenStream.from_source("sum = sum + SUM;")
+        self.assertEqual(len(stream), 6)
+        self.assertEqual(stream.lexemes, ['sum', '=', '+', ';'])
+        self.assertEqual(stream.token_type(0), 'identifier')
+        self.assertEqual(stream.token_value(4), 'sum')
+        self.assertEqual((stream.starts[4], stream.lengths[4]), (12, 3))
+
+    def test_token_interface(self):
+        """Test the lexer token interface used by RDP"""
+        stream = TokenStream.from_source("$function convertx (fahr integer)")
+        tokens = Lexer("$function convertx (fahr integer)").tokens
+        self.assertEqual(stream.peek_next_token(), tokens[0])
+        self.assertEqual(stream.get_next_token(), tokens[0])
+        self.assertEqual(stream.get_next_token_val(), 'function')
+        self.assertEqual(stream.get_next_token(), tokens[1])
+        self.assertEqual(stream.get_prev_token(), tokens[1])
+        stream.backtrack()
+        self.assertEqual(stream.get_next_token(), tokens[1])
+        stream.curr_token = len(tokens)
+        self.assertIsNone(stream.get_next_token())
+        self.assertEqual(stream.get_next_token_val(), '')
+
+    def test_rdp(self):
+        """Test that RDP generates the same instructions from a TokenStream"""
+        with open("RAT24S_programs/program_3.txt") as source_file:
+            source_code = source_file.read()
+        parser = RDP(TokenStream.from_source(source_code))
+        self.assertTrue(parser.rat24s())
+        expected_parser = RDP(Lexer(source_code))
+        expected_parser.rat24s()
+        self.assertEqual(parser.asm_instructions, expected_parser.asm_instructions)
+
+class TestParallelLexer(unittest.TestCase):
+    """Test that tokenizing chunks in worker processes returns the same tokens as the lexer"""
+
+    def test_split_source(self):
+        """Test that the source code is only split at whitespace outside of comments"""
+        source_code = "a <= b [* c d e *] f\ng [* h i"
+        boundaries = split_source(source_code, len(source_code))
+        self.assertEqual(boundaries, [1, 4, 6, 18, 20, 22])
+
+    def test_sample_programs(self):
+        """Test every sample program split into many small chunks"""
+        for filename in sorted(os.listdir('RAT24S_programs')):
+            with open(os.path.join('RAT24S_programs', filename), encoding='utf-8-sig') as source_file:
+                source_code = source_file.read()
+            expected_tokens = Lexer(source_code).tokens
+            stream = TokenStream.from_source(source_code, workers=2, chunk_size=16)
+            self.assertEqual(list(stream), expected_tokens, filename)
+            positions = [(tok.line, tok.column, tok.offset) for tok in stream]
+            expected_positions = [(tok.line, tok.column, tok.offset) for tok in expected_tokens]
+            self.assertEqual(positions, expected_positions, filename)
+
+    def test_unterminated_comment(self):
+        """Test that an unterminated comment in the last chunk is reported"""
+        source_code = "a = b;\n" * 8 + "  [* no end\n c = d;"
+        stream = TokenStream.from_source(source_code, workers=2, chunk_size=8)
+        lexer = Lexer(source_code)
+        self.assertEqual(list(stream), lexer.tokens)
+        self.assertEqual(stream.errors, ["Error: Unterminated comment (line 9, column 3)"])
+
+    def test_lexer_scanner(self):
+        """Test that the parallel scanner saves the same tokens as the regex scanner"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+        chunk_size = TokenStream.parallel_chunk_size
+        TokenStream.parallel_chunk_size = 64
+        try:
+            lexer = Lexer(source_code, scanner='parallel', workers=2)
+        finally:
+            TokenStream.parallel_chunk_size = chunk_size
+        self.assertEqual(lexer.tokens, Lexer(source_code).tokens)
+        self.assertEqual(lexer.errors, [])
+
+class TestTokenCache(unittest.TestCase):
+    """Test binary token files and the token cache"""
+
+    def test_token_file(self):
+        """Test that a token file is read back with the same tokens, positions, and errors"""
+        source_code = "a = bB [* c\n *]\n 1.5 != é;\n[* open"
+        stream = TokenStream.from_source(source_code)
+        token_file = io.BytesIO()
+        write_token_file(token_file, stream)
+        token_file.seek(0)
+        loaded = read_token_file(token_file)
+        self.assertEqual(list(loaded), list(stream))
+        positions = [(tok.line, tok.column, tok.offset) for tok in loaded]
+        self.assertEqual(positions, [(tok.line, tok.column, tok.offset) for tok in stream])
+        self.assertEqual(loaded.lexemes, stream.lexemes)
+        self.assertEqual(loaded.errors, ["Error: Unterminated comment (line 4, column 1)"])
+
+    def test_invalid_token_file(self):
+        """Test that files that are not token files are rejected"""
+        with self.assertRaises(ValueError):
+            read_token_file(io.BytesIO(b"integer x;"))
+        token_file = io.BytesIO()
+        write_token_file(token_file, TokenStream.from_source("a b c"))
+        with self.assertRaises(ValueError):
+            read_token_file(io.BytesIO(token_file.getvalue()[:-4]))
+
+    def test_save_tokens(self):
+        """Test that tokens are saved as text with their positions"""
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = os.path.join(out_dir, "tokens.txt")
+            Lexer("while (x)\n  y = 1.5;").save_tokens(filename)
+            with open(filename) as tokens_txt:
+                lines = tokens_txt.read().split('\n')
+        self.assertEqual(lines[:4], [
+            "Token          Line:Column    Lexeme",
+            "",
+            "keyword        1:1            while",
+            "separator      1:7            (",
+        ])
+        self.assertEqual(lines[-2:], ["separator      2:10           ;", ""])
+
+    def test_save_tokens_bin(self):
+        """Test that a Lexer loaded from a binary token file has the saved tokens"""
+        with open("RAT24S_programs/program_3.txt", encoding='utf-8-sig') as source_file:
+            source_code = source_file.read()
+        lexer = Lexer(source_code + "\n[* unterminated")
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = os.path.join(out_dir, "tokens.bin")
+            lexer.save_tokens(filename, 'bin')
+            loaded = Lexer.from_token_file(filename)
+            text_filename = os.path.join(out_dir, "tokens.txt")
+            loaded_text_filename = os.path.join(out_dir, "loaded_tokens.txt")
+            lexer.save_tokens(text_filename)
+            loaded.save_tokens(loaded_text_filename)
+            with open(text_filename) as tokens_txt, open(loaded_text_filename) as loaded_tokens_txt:
+                self.assertEqual(loaded_tokens_txt.read(), tokens_txt.read())
+        self.assertEqual(list(loaded.tokens), lexer.tokens)
+        self.assertEqual(loaded.errors, lexer.errors)
+        parser = RDP(loaded)
+        self.assertTrue(parser.rat24s())
+
+    def test_save_tokens_invalid_format(self):
+        """Test that an invalid token file format raises an error"""
+        with self.assertRaises(ValueError):
+            Lexer("a").save_tokens("tokens.csv", 'csv')
+
+    def test_load_and_store(self):
+        """Test that tokens are only loaded for the same source code bytes"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(cache_dir)
+            self.assertIsNone(cache.load(b"a = b;"))
+            cache.store(b"a = b;", TokenStream.from_source("a = b;"))
+            self.assertEqual(list(cache.load(b"a = b;")), Lexer("a = b;").tokens)
+            self.assertIsNone(cache.load(b"a = c;"))
+
+    def test_evict(self):
+        """Test that the least recently used token files are evicted"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(cache_dir)
+            for idx, source in enumerate([b"a;", b"b;", b"c;"]):
+                cache.store(source, TokenStream.from_source(source.decode()))
+                os.utime(cache.path(cache.key(source)), (idx, idx))
+            size = os.path.getsize(cache.path(cache.key(b"a;")))
+            # Reading the tokens of a; makes b; the least recently used
+            cache.load(b"a;")
+            cache.max_bytes = 2 * size
+            cache.evict()
+            self.assertIsNotNone(cache.load(b"a;"))
+            self.assertIsNone(cache.load(b"b;"))
+            self.assertIsNotNone(cache.load(b"c;"))
+
+    def test_lexer(self):
+        """Test that cached tokens are loaded as a list with the same tokens and positions"""
+        testcase_file = "RAT24S_programs/add_sum.txt"
+        expected = Lexer.from_file(testcase_file).tokens
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(cache_dir)
+            for _ in range(2):
+                tokens = cache.lexer(testcase_file).tokens
+                self.assertIsInstance(tokens, list)
+                self.assertEqual(tokens, expected)
+                self.assertEqual([(token.line, token.column, token.offset) for token in tokens],
+                                 [(token.line, token.column, token.offset) for token in expected])
+            self.assertIsNotNone(cache.load_key(cache.file_key(testcase_file)))
+
+    def test_large_offsets(self):
+        """Test that tokens past 4 GiB of source code are stored and read back with their offsets"""
+        tokens = [Token('identifier', 'a', 1, 1, 0), Token('identifier', 'b', 2, 3, 2**32 + 5)]
+        with self.assertRaises(OverflowError):
+            TokenStream.from_tokens(tokens)
+        stream = TokenStream.from_tokens(tokens, max_offset=2**32 + 6)
+        token_file = io.BytesIO()
+        write_token_file(token_file, stream)
+        token_file.seek(0)
+        tokens_read = read_token_file(token_file).to_list()
+        self.assertEqual([token.offset for token in tokens_read], [0, 2**32 + 5])
+
+    def test_unwritable_cache(self):
+        """Test that tokens are still returned when the cache directory cannot be written to"""
+        testcase_file = "RAT24S_programs/add_sum.txt"
+        expected = Lexer.from_file(testcase_file).tokens
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The cache directory would be inside a file
+            not_a_directory = os.path.join(cache_dir, 'file')
+            open(not_a_directory, 'w').close()
+            cache = TokenCache(os.path.join(not_a_directory, 'cache'))
+            self.assertEqual(cache.lexer(testcase_file).tokens, expected)
+            self.assertIsNone(cache.load(b"a;"))
+            # Nothing is left behind when the token file cannot be moved in
+            # place, here because a directory is in the way
+            cache = TokenCache(cache_dir)
+            token_path = cache.path(cache.file_key(testcase_file))
+            os.mkdir(token_path)
+            self.assertEqual(cache.lexer(testcase_file).tokens, expected)
+            self.assertEqual(sorted(os.listdir(cache_dir)), sorted(['file', os.path.basename(token_path)]))
+
+    def test_compiler(self):
+        """Test that the compiler gives the same result with cached tokens"""
+        testcase_file = "RAT24S_programs/add_sum.txt"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            asm_filename = os.path.join(cache_dir, "out.asm")
+            outputs = []
+            # Without the cache, then storing and loading the cached tokens
+            for used_cache_dir in [None, cache_dir, cache_dir]:
+                main(testcase_file, False, None, False, None, None, asm_filename, None,
+                     used_cache_dir, supress_print=True)
+                with open(asm_filename) as asm_file:
+                    outputs.append(asm_file.read())
+            self.assertEqual(outputs[1], outputs[0])
+            self.assertEqual(outputs[2], outputs[0])
+            self.assertEqual(len([name for name in os.listdir(cache_dir) if name.endswith('.tok')]), 1)
+
 class TestRDP(unittest.TestCase):
     """Test recursive descent parser"""
     
@@ -622,6 +1186,119 @@ class TestRDP(unittest.TestCase):
         self.assertTrue(is_empty, f"Not recognized as Empty: {empty}")
         self.assertEqual(l.curr_token, len(l.tokens), f"Did not parse all tokens {l.curr_token}/{len(l.tokens)} in str: {empty}")
 
+    def test_error_position(self):
+        """Test that error messages include the line and column of the error"""
+        source = "$\n$\n$\n  print(true);\n  x = 1;\n"
+        parser = RDP(Lexer(source), print_to_console=True)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertFalse(parser.rat24s())
+        errors = [line for line in output.getvalue().split('\n') if 'Error' in line]
+        self.assertEqual(errors[0], "  Error: Identifier x was not declared (line 5, column 3)")
+        self.assertEqual(errors[-1], "  Error: Expected final '$' at the end of the program. (line 5, column 8)")
+
+    def test_nested_statement_errors(self):
+        """Test that the nodes of statements that fail inside other statements are dropped"""
+        programs = [
+            "$ $ integer a, c; $ if (a < c) { if (a < c) a c = 1; else a = 1; endif } else a = 1; endif $",
+            "$ $ integer a, c; $ while (a < c) { while (a < c) a c = 1; endwhile } endwhile $",
+            "$ $ integer a, c; $ { { a c = 1; } } $",
+            "$ $ integer a, c; $ a = f(a c); $",
+        ]
+        for program in programs:
+            parser = RDP(Lexer(program))
+            self.assertFalse(parser.rat24s(), program)
+
+    def test_error_recovery(self):
+        """Test that the parser reports every syntax error of a program and parses the statements between them"""
+        source = ("$\n$\ninteger a, b;\n$\n"
+                  "a = ;\n"
+                  "while (a < b) { a = a + ; b = 1; } endwhile\n"
+                  "if (a > ) b = 2; endif\n"
+                  "print(a);\n"
+                  "c = 3;\n"
+                  "$\n")
+        parser = RDP(Lexer(source), recover=True)
+        self.assertFalse(parser.rat24s())
+        self.assertEqual([str(diagnostic) for diagnostic in parser.diagnostics], [
+            "Error: Unexpected ';' in statement. (line 5, column 5)",
+            "Error: Unexpected ';' in statement. (line 6, column 25)",
+            "Error: Unexpected ')' in statement. (line 7, column 9)",
+            "Error: Identifier c was not declared (line 9, column 1)",
+        ])
+        self.assertEqual([diagnostic.token_index for diagnostic in parser.diagnostics], [10, 22, 33, 48])
+        # The statements with errors are left out of the syntax tree
+        statements = parser.nodes[0].statements
+        self.assertEqual([type(statement) for statement in statements], [While, Print, Assign])
+        self.assertEqual(statements[0].body, Compound([Assign(Identifier('b', address=5001), Integer('1'))]))
+        self.assertEqual(parser.blocks, [])
+
+    def test_error_recovery_blocks(self):
+        """Test that recovering skips the blocks opened by a statement with an error, and stops at blocks it is in"""
+        source = "{ while (1 < 2) { a = ; } b = 1; } c = 1; $"
+        parser = RDP(Lexer(source), recover=True)
+        parser.ignore_symbol_table = True
+        # The while statement is missing endwhile, so its block is closed
+        # with the compound statement it is in
+        self.assertTrue(parser.statement_list())
+        self.assertEqual([str(diagnostic) for diagnostic in parser.diagnostics], [
+            "Error: Unexpected ';' in statement. (line 1, column 23)",
+            "Error: Unexpected 'b' in statement. (line 1, column 27)",
+        ])
+        self.assertEqual(parser.nodes, [Compound([]), Assign(Identifier('c'), Integer('1'))])
+        self.assertEqual(parser.lexer.peek_next_token().value, '$')
+
+    def test_error_recovery_sections(self):
+        """Test that recovering skips a section of the program with an error up to the next $"""
+        source = "$ function $ integer a b; $ a = 1; $"
+        parser = RDP(Lexer(source), recover=True)
+        self.assertFalse(parser.rat24s())
+        self.assertEqual([diagnostic.message for diagnostic in parser.diagnostics], [
+            "Error: Expected identifier after 'function' keyword.",
+            "Error: Issue parsing optional function definitions.",
+            "Error: Expected '$' after optional declaration list.",
+        ])
+        self.assertEqual(parser.nodes, [Program([], [Assign(Identifier('a', address=5000), Integer('1'))])])
+        # Without recovery, parsing stops at the first error
+        parser = RDP(Lexer(source))
+        self.assertFalse(parser.rat24s())
+        self.assertEqual(len(parser.diagnostics), 2)
+
+    def test_list_productions(self):
+        """Test that list productions are printed before the elements they are decided by"""
+        source = "$ $ integer a; $ a = 1; print(a); $"
+        parser = RDP(Lexer(source), print_to_console=True)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertTrue(parser.rat24s())
+        lines = output.getvalue().split('\n')
+        productions = [line.strip() for line in lines if line.startswith('  <Statement')]
+        self.assertEqual(productions[0], "<Statement List> --> <Statement> <Statement List>")
+        self.assertEqual(productions[1], "<Statement> --> <Assign>")
+        self.assertEqual(productions[2], "<Statement List> --> <Statement>")
+        self.assertEqual(productions[3], "<Statement> --> <Print>")
+        # Every token is printed once
+        self.assertEqual(sum(line.startswith('Token:') for line in lines), 16)
+
+    def test_long_program(self):
+        """Test that long lists and deeply nested statements do not exceed the recursion limit"""
+        count = sys.getrecursionlimit() * 2
+        ids = ', '.join(f"a{idx}" for idx in range(count))
+        statements = ' '.join(f"a{idx} = {idx};" for idx in range(count))
+        params = ', '.join(f"p{idx} integer" for idx in range(count))
+        nested = "a0 = 1;"
+        for idx in range(count):
+            nested = ["{ %s }", "while (a0 < 5) %s endwhile", "if (a0 > 1) %s endif"][idx % 3] % nested
+        source = f"$ function f ({params}) {{ return a0; }} $ integer {ids}; $ {statements} {nested} $"
+        parser = RDP(Lexer(source))
+        self.assertTrue(parser.rat24s())
+        self.assertEqual(len(parser.symbol_table.symbols), count)
+
+    def test_function_with_declarations(self):
+        """Test that declarations inside a function are only inserted once"""
+        source = "$ function f (x integer) integer y; { y = x; } $ $ print (true); $"
+        parser = RDP(Lexer(source))
+        self.assertTrue(parser.rat24s())
+        self.assertEqual(list(parser.symbol_table.symbols), ['y'])
+
     def test_insert_integer_symbol(self):
         """
         Test that the RDP parser correctly inserts integer identifiers
@@ -691,6 +1368,94 @@ class TestRDP(unittest.TestCase):
 
         self.assertEqual(parser.symbol_table.symbols,  expected_symbols)
 
+class TestTraceWriter(unittest.TestCase):
+    """Test the buffered trace writer used by the parser"""
+    def test_flush_lines(self):
+        """Test that lines are written once flush_lines lines are buffered, and tokens are formatted"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'trace.txt')
+            trace = TraceWriter(out_filename=filename, flush_lines=3)
+            trace.write('  <Primary> --> <Integer>')
+            trace.write(Token('integer', '7'))
+            with open(filename) as trace_file:
+                self.assertEqual(trace_file.read(), '')
+            trace.write('  <Term_prime> --> <Empty>')
+            expected = "  <Primary> --> <Integer>\nToken: integer         Lexeme: 7\n  <Term_prime> --> <Empty>\n"
+            with open(filename) as trace_file:
+                self.assertEqual(trace_file.read(), expected)
+            trace.write('  <Expression_prime> --> <Empty>')
+            trace.close()
+            with open(filename) as trace_file:
+                self.assertEqual(trace_file.read(), expected + '  <Expression_prime> --> <Empty>\n')
+
+    def test_no_output(self):
+        """Test that the parser has no trace writer when the trace is neither printed nor saved"""
+        self.assertIsNone(TraceWriter.open())
+        parser = RDP(Lexer("$ $ $ print (1); $"))
+        self.assertIsNone(parser.trace)
+        self.assertTrue(parser.rat24s())
+        self.assertEqual(parser.deferred_output, [])
+
+    def test_same_output(self):
+        """Test that the output does not depend on how many lines are buffered"""
+        with open('RAT24S_programs/program_3.txt') as source_file:
+            source = source_file.read()
+        outputs = []
+        for flush_lines in [1, 5, 4096]:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                parser = RDP(Lexer(source), print_to_console=True)
+                parser.trace.flush_lines = flush_lines
+                self.assertTrue(parser.rat24s())
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertIn("Token: identifier      Lexeme: var1\n", outputs[0])
+
+    def structured_trace(self, source, trace_format='jsonl', **filters):
+        """Return the text trace and the records of the structured trace of source"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'trace.' + trace_format)
+            parser = RDP(Lexer(source), trace=StructuredTraceWriter(filename, trace_format, flush_lines=100, **filters))
+            text_parser = RDP(Lexer(source), print_to_console=True)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(parser.rat24s(), text_parser.rat24s())
+            parser.close()
+            with open(filename, 'rb') as trace_file:
+                records = list(read_trace(trace_file))
+        return output.getvalue(), records
+
+    def test_structured_trace(self):
+        """Test that structured traces are rendered back to the same text trace"""
+        with open('RAT24S_programs/program_3.txt') as source_file:
+            source = source_file.read()
+        for trace_format in ['jsonl', 'bin']:
+            text, records = self.structured_trace(source, trace_format)
+            self.assertEqual('\n'.join(render_trace(records)) + '\n', text)
+            # Tokens are numbered in order, and statements in the while loop are nested in it
+            tokens = [record for record in records if record[0] == 'token']
+            self.assertEqual([record[2] for record in tokens], list(range(len(tokens))))
+            self.assertIn(('production', '  <Statement> --> <Print>', 82, 3), records)
+
+    def test_structured_trace_filters(self):
+        """Test that structured traces keep only the records that pass the filters"""
+        source = "$ $ integer a; $ a = 1; print(a); b = a; while (a < 3) a = a + 1; endwhile $"
+        text, records = self.structured_trace(source, 'bin', kinds=['error'])
+        self.assertEqual(records, [('error', '  Error: Identifier b was not declared (line 1, column 35)', 19, 1)])
+
+        text, records = self.structured_trace(source, kinds=['production'], nonterminals=['Statement', 'Relop'])
+        expected = [line for line in text.split('\n') if line.startswith(('  <Statement>', '  <Relop>'))]
+        self.assertEqual(render_trace(records), expected)
+
+        text, records = self.structured_trace(source, sample=10)
+        # Every 10th record and the error
+        lines = text.split('\n')[:-1]
+        self.assertEqual(len(records), (len(lines) - 1) // 10 + 1)
+        self.assertEqual([record[0] for record in records].count('error'), 1)
+        self.assertEqual(render_trace(records[:2]), [lines[9], lines[19]])
+
+        with self.assertRaises(ValueError):
+            StructuredTraceWriter('trace.jsonl', kinds=['text'])
+
 class TestSymbolTable(unittest.TestCase):
     """Test Symbol table methods"""
     def test_initial_mem_address(self):
@@ -921,6 +1686,42 @@ class TestCompiler(unittest.TestCase):
             # Remove output file
             os.remove(temp_out)
 
+    def test_diagnostics(self):
+        """Test that every syntax error of the source code is printed"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_filename = os.path.join(tmp_dir, 'errors.txt')
+            with open(source_filename, 'w') as source_file:
+                source_file.write("$\n$\ninteger a;\n$\na = ;\nprint(a);\nwhile (a < ) a = 1; endwhile\n$\n")
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                main(source_filename, False, None, False, None, None, None, lambda: None)
+        self.assertEqual(output.getvalue().split('\n')[:3], [
+            "Error: Unexpected ';' in statement. (line 5, column 5)",
+            "Error: Unexpected ')' in statement. (line 7, column 12)",
+            "Invalid RAT24S program",
+        ])
+
+    def test_diagnostics_with_productions(self):
+        """Test that syntax errors are printed once when the productions are printed"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_filename = os.path.join(tmp_dir, 'errors.txt')
+            with open(source_filename, 'w') as source_file:
+                source_file.write("$\n$\ninteger a;\n$\na = ;\nprint(a);\n$\n")
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                main(source_filename, False, None, True, None, None, None, lambda: None)
+        self.assertEqual(output.getvalue().count("Unexpected ';' in statement."), 1)
+        self.assertIn("Invalid RAT24S program", output.getvalue())
+
+    def test_trace_arguments(self):
+        """Test that --trace-kinds and --trace-sample are checked by the argument parser"""
+        args = utils.parse_arguments(['a.source', '--trace-kinds', 'token', '--trace-kinds', 'error',
+                                      '--trace-sample', '3'])
+        self.assertEqual(args[11], ['token', 'error'])
+        self.assertEqual(args[13], 3)
+        for bad_args in (['--trace-kinds', 'tokens'], ['--trace-sample', '0'], ['--trace-sample', 'x']):
+            with contextlib.redirect_stderr(io.StringIO()) as errors, self.assertRaises(SystemExit):
+                utils.parse_arguments(['a.source'] + bad_args)
+            self.assertIn('usage:', errors.getvalue())
+
     def test_symbol_table_arg(self):
         """
         Test that using the --symbol-table argument in the command line
@@ -1163,6 +1964,72 @@ class TestAssemblyInstructions(unittest.TestCase):
         actual_instruction = parser.asm_instructions[1]
         self.assertEqual(actual_instruction, correct_instruction)
 
+    def test_expression_instructions(self):
+        """
+        Test that nested expressions generate their instructions in the same
+        order as before expressions were parsed in one loop
+        """
+        source = "integer a, b, c; a = (b + c * 2 - -a) / (a - b * (c + 1)) + 3 * b;"
+        l = Lexer(source)
+        parser = RDP(l)
+        parser.declaration_list()
+        self.assertTrue(parser.assign())
+        expected_instructions = [
+            'PUSHM 5001', 'A', 'PUSHM 5002', 'M', 'PUSHI 2', 'PUSHM 5000', 'S',
+            'PUSHM 5000', 'PUSHM 5001', 'PUSHM 5002', 'PUSHI 1', 'A', 'M', 'S', 'D',
+            'A', 'PUSHI 3', 'PUSHM 5001', 'PUSHM 5001', 'M', 'POPM 5000'
+        ]
+        self.assertEqual(parser.asm_instructions, expected_instructions)
+
+        # Undeclared identifiers are reported without stopping the expression
+        source = "integer a, b; a = b * x - (2 + a);"
+        l = Lexer(source)
+        parser = RDP(l)
+        parser.declaration_list()
+        self.assertTrue(parser.assign())
+        error = 'Error: Identifier x was not declared (line 1, column 23)'
+        expected_instructions = ['PUSHM 5001', error, 'M', error, 'PUSHI 2', 'PUSHM 5000', 'A', 'S', 'POPM 5000']
+        self.assertEqual(parser.asm_instructions, expected_instructions)
+        self.assertEqual(parser.semantic_errors, 2)
+
+    def test_syntax_tree(self):
+        """Test that the parser builds the syntax tree that code is generated from"""
+        source = "$ function f (n integer) { return n; } $ integer i; $ while (i < 3) { i = i + f(i); } endwhile $"
+        parser = RDP(Lexer(source))
+        self.assertTrue(parser.rat24s())
+        i = Identifier('i', address=5000)
+        expected_tree = Program(
+            [Function('f', [Return(Identifier('n', error="Error: Identifier n was not declared (line 1, column 35)"))])],
+            [While(Condition(i, '<', Integer('3')),
+                   Compound([Assign(i, BinaryOp('+', i, Call('f', [Identifier('i')])))]))])
+        self.assertEqual(parser.nodes, [expected_tree])
+        with self.assertRaises(AttributeError):
+            expected_tree.body = []
+
+    def test_incomplete_instructions(self):
+        """Test that statements that fail to parse generate the instructions of what was parsed of them"""
+        expected = [
+            ("a = a + 2 * ;", ['PUSHM 5000', 'A', 'PUSHI 2']),
+            ("while (a < 3) a = a + 1;", ['LABEL', 'PUSHM 5000', 'PUSHI 3', 'LES', 'JUMP0 UNDEFINED',
+                                          'PUSHM 5000', 'PUSHI 1', 'A', 'POPM 5000']),
+            ("print(a + 1;", ['PUSHM 5000', 'PUSHI 1', 'A']),
+            ("scan(a, b);", ['SIN', 'POPM 5000', 'SIN', 'Error: Identifier b was not declared (line 1, column 26)']),
+        ]
+        for statement, expected_instructions in expected:
+            parser = RDP(Lexer(f"$ $ integer a; $ {statement} $"))
+            self.assertFalse(parser.rat24s())
+            self.assertEqual(parser.asm_instructions, expected_instructions)
+
+    def test_function_identifiers(self):
+        """Test that undeclared identifiers in function bodies are reported and generate their error"""
+        source = "$ function convert (fahr integer) { return 5 * (fahr - 32) / 9; } $ $ print(1); $"
+        parser = RDP(Lexer(source))
+        self.assertTrue(parser.rat24s())
+        error = 'Error: Identifier fahr was not declared (line 1, column 49)'
+        self.assertEqual([str(diagnostic) for diagnostic in parser.diagnostics], [error])
+        expected_instructions = ['PUSHI 5', error, 'PUSHI 32', 'S', 'PUSHI 9', 'D', 'M', 'PUSHI 1', 'SOUT']
+        self.assertEqual(parser.asm_instructions, expected_instructions)
+
     def test_multiple_assignment(self):
         """
         Test correct assembly instructions with multiple assignment statements
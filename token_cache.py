@@ -0,0 +1,221 @@
+"""Binary token files and the on-disk token cache used by the compiler"""
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from lexer import Lexer
+from token_stream import TokenStream
+
+# Token file layout, after the header:
+# 1. the type_codes, starts, lengths, lines, columns, and lexeme_ids arrays
+#    of a TokenStream, token count entries each
+# 2. the lexeme table: an array with the length in bytes of each lexeme,
+#    followed by the UTF-8 encoded lexemes
+# 3. the lexer errors, stored like the lexeme table
+TOKEN_FILE_MAGIC = b'RAT24S'
+# Increase when the layout of token files changes
+TOKEN_FILE_VERSION = 1
+# Magic, version, byte order ('<' or '>'), typecode of the offset arrays,
+# token count, lexeme count, and error count
+TOKEN_FILE_HEADER = struct.Struct('<6sHccQII')
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+def encode_strings(strings):
+    """Return a list with an array of the encoded lengths of strings, and the encoded strings"""
+    encoded = [string.encode('utf-8') for string in strings]
+    return [array('I', map(len, encoded)).tobytes(), b''.join(encoded)]
+
+def write_token_file(token_file, stream):
+    """Write the TokenStream stream to the binary file object token_file in one write"""
+    header = TOKEN_FILE_HEADER.pack(TOKEN_FILE_MAGIC, TOKEN_FILE_VERSION, BYTE_ORDER,
+                                    stream.starts.typecode.encode(), len(stream),
+                                    len(stream.lexemes), len(stream.errors))
+    parts = [header]
+    for column in (stream.type_codes, stream.starts, stream.lengths,
+                   stream.lines, stream.columns, stream.lexeme_ids):
+        parts.append(column.tobytes())
+    parts += encode_strings(stream.lexemes)
+    parts += encode_strings(stream.errors)
+    token_file.write(b''.join(parts))
+
+def read_token_file(token_file):
+    """
+    Read a TokenStream written by write_token_file from the binary file
+    object token_file with one read.
+    Raises ValueError if token_file is not a token file of this version.
+    """
+    data = memoryview(token_file.read())
+    if len(data) < TOKEN_FILE_HEADER.size:
+        raise ValueError("File is not a token file.")
+    magic, version, byte_order, offset_typecode, token_count, lexeme_count, error_count = \
+        TOKEN_FILE_HEADER.unpack_from(data)
+    if magic != TOKEN_FILE_MAGIC:
+        raise ValueError("File is not a token file.")
+    if version != TOKEN_FILE_VERSION:
+        raise ValueError(f"Token file version {version} is not supported.")
+
+    pos = TOKEN_FILE_HEADER.size
+
+    def read_array(typecode, count):
+        nonlocal pos
+        column = array(typecode)
+        end = pos + column.itemsize * count
+        if end > len(data):
+            raise ValueError("Token file is truncated.")
+        column.frombytes(data[pos:end])
+        if byte_order != BYTE_ORDER:
+            column.byteswap()
+        pos = end
+        return column
+
+    def read_strings(count):
+        nonlocal pos
+        strings = []
+        for length in read_array('I', count):
+            if pos + length > len(data):
+                raise ValueError("Token file is truncated.")
+            strings.append(str(data[pos:pos + length], 'utf-8'))
+            pos += length
+        return strings
+
+    stream = TokenStream(max_offset=2**32 if offset_typecode == b'Q' else 0)
+    stream.type_codes = read_array('B', token_count)
+    stream.starts = read_array(offset_typecode.decode(), token_count)
+    stream.lengths = read_array(offset_typecode.decode(), token_count)
+    stream.lines = read_array('I', token_count)
+    stream.columns = read_array('I', token_count)
+    stream.lexeme_ids = read_array('I', token_count)
+    for lexeme in read_strings(lexeme_count):
+        stream.lexeme_id(lexeme)
+    stream.errors = read_strings(error_count)
+    return stream
+
+class TokenCache:
+    """
+    Directory of token files, each named by a hash of the source code bytes
+    it was tokenized from and of the lexer version, so changing either the
+    source code or the lexer never reuses stale tokens.
+    Once the files in the directory take more than max_bytes, the least
+    recently used files are deleted. Reading a file marks it as used by
+    updating its modification time.
+    """
+    # Default size limit of a cache directory
+    max_bytes = 256 << 20
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    # Number of bytes of a source file hashed at a time
+    read_chunk_size = 1 << 16
+
+    @staticmethod
+    def digest():
+        """Return a hash of the token file and lexer versions, to be updated with source code bytes"""
+        digest = hashlib.sha256()
+        digest.update(f"{TOKEN_FILE_VERSION}:{Lexer.version}:{Lexer.re_master.pattern}\0".encode())
+        return digest
+
+    @classmethod
+    def key(cls, source_bytes):
+        """Return the key of the tokens of source_bytes"""
+        digest = cls.digest()
+        digest.update(source_bytes)
+        return digest.hexdigest()
+
+    @classmethod
+    def file_key(cls, path):
+        """Return the key of the tokens of the source code file at path, reading it in chunks"""
+        digest = cls.digest()
+        with open(path, 'rb') as source_file:
+            for chunk in iter(lambda: source_file.read(cls.read_chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        """Return the path of the token file with key"""
+        return os.path.join(self.directory, key + '.tok')
+
+    def load(self, source_bytes):
+        """Return the cached TokenStream of source_bytes, or None if it is not cached"""
+        return self.load_key(self.key(source_bytes))
+
+    def load_key(self, key):
+        """Return the cached TokenStream with key, or None if it is not cached"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as token_file:
+                stream = read_token_file(token_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return stream
+
+    def store(self, source_bytes, stream):
+        """Cache the TokenStream stream of source_bytes, then evict old token files"""
+        self.store_key(self.key(source_bytes), stream)
+
+    def store_key(self, key, stream):
+        """
+        Cache the TokenStream stream with key, then evict old token files.
+        If the cache directory cannot be written to, the tokens are not
+        cached, like load_key treats a token file it cannot read as missing.
+        """
+        temp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so a token file is never partially written
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as token_file:
+                temp_path = token_file.name
+                write_token_file(token_file, stream)
+            os.replace(temp_path, self.path(key))
+            temp_path = None
+            self.evict()
+        except OSError:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Delete the least recently used token files until the cache fits in max_bytes"""
+        entries = []
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                if entry.name.endswith('.tok'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def lexer(self, path):
+        """
+        Return a Lexer with the tokens of the source code file at path,
+        loaded from the cache, or tokenized and cached if the file is not
+        cached yet.
+        Cached tokens are turned into a list of Token objects once, since the
+        parser reads every token. A file that is not cached is tokenized in
+        chunks with Lexer.from_file, so neither path holds the whole source
+        code in memory. The lexer's sourceCode is empty.
+        """
+        key = self.file_key(path)
+        stream = self.load_key(key)
+        if stream is not None:
+            return Lexer.from_tokens(stream.to_list(), stream.errors)
+        lexer = Lexer.from_file(path)
+        stream = TokenStream.from_tokens(lexer.tokens, max_offset=os.path.getsize(path))
+        stream.errors = list(lexer.errors)
+        self.store_key(key, stream)
+        return lexer
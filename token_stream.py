@@ -0,0 +1,272 @@
+"""Compact, column-oriented store of the tokens returned by the lexer"""
+import bisect
+import re
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from lexer import Lexer
+from parse_token import Token, TOKEN_TYPE_CODES, TOKEN_TYPES
+
+# Comments, and an unterminated comment running to the end of the source code
+re_comment_span = re.compile(r'\[\*[\s\S]*?(?:\*\]|\Z)')
+re_whitespace = re.compile(r'\s')
+
+def split_source(source_code, parts):
+    """
+    Return the offsets where source_code can be split into about parts chunks
+    that are tokenized separately. Each offset is a whitespace character
+    outside of any comment, so:
+    1. no token, including two-character operators like <= and comments,
+       spans a boundary
+    2. the master pattern only looks one character past a match, and treats
+       whitespace like the end of the source code, so a chunk's tokens are
+       the same as the tokens of the same text in the whole source code
+    """
+    comments = [match.span() for match in re_comment_span.finditer(source_code)]
+    comment_starts = [start for start, _ in comments]
+    boundaries = []
+    for part in range(1, parts):
+        pos = max(len(source_code) * part // parts, boundaries[-1] + 1 if boundaries else 1)
+        while pos < len(source_code):
+            # Skip to the end of the comment containing pos, if any
+            idx = bisect.bisect_right(comment_starts, pos) - 1
+            if idx >= 0 and comments[idx][1] > pos:
+                pos = comments[idx][1]
+                continue
+            if re_whitespace.match(source_code, pos):
+                boundaries.append(pos)
+                break
+            match = re_whitespace.search(source_code, pos)
+            pos = match.start() if match else len(source_code)
+        if pos >= len(source_code):
+            break
+    return boundaries
+
+def tokenize_chunk(chunk, offset, line, line_start, max_offset):
+    """
+    Tokenize a chunk of the source code returned by split_source into a
+    TokenStream. Runs in a worker process of TokenStream.from_source_parallel.
+    """
+    stream = TokenStream(max_offset=max_offset)
+    stream.scan(chunk, offset, line, line_start)
+    return stream
+
+class TokenStream:
+    """
+    Store tokens in parallel arrays instead of a list of Token objects:
+    1. type_codes: the type code of each token (see parse_token.TOKEN_TYPES)
+    2. starts: the offset of each token in the source code
+    3. lengths: the length of each token in the source code
+    4. lines and columns: the line and column of each token
+    5. lexeme_ids: the index of each token's value in the lexeme table
+    Each distinct lowercase lexeme is only stored once in the lexeme table.
+    A TokenStream has the same token interface as Lexer, so it can be passed
+    to RDP in place of a Lexer. Token objects are only created when a token
+    is asked for.
+    """
+    # Minimum number of characters of source code per chunk when tokenizing
+    # with several worker processes
+    parallel_chunk_size = 1 << 22
+
+    def __init__(self, *, max_offset=0):
+        # Offsets that do not fit in 32 bits need 64-bit arrays
+        offset_typecode = 'I' if max_offset < 2**32 else 'Q'
+        self.type_codes = array('B')
+        self.starts = array(offset_typecode)
+        self.lengths = array(offset_typecode)
+        self.lines = array('I')
+        self.columns = array('I')
+        self.lexeme_ids = array('I')
+        self.lexemes = []
+        self.lexeme_index = {}
+        self.curr_token = 0  # Used to iterate through tokens by get_next_token method
+        # Error messages for unterminated comments
+        self.errors = []
+
+    @classmethod
+    def from_source(cls, source_code, *, workers=1, chunk_size=None):
+        """
+        Tokenize source_code with the lexer's master pattern into a TokenStream.
+        If workers is more than 1, source code longer than chunk_size
+        characters is split with split_source and the chunks are tokenized in
+        parallel by worker processes. The tokens, positions, and errors are the
+        same as when tokenizing serially.
+        """
+        if chunk_size is None:
+            chunk_size = cls.parallel_chunk_size
+        if workers > 1 and len(source_code) > chunk_size:
+            return cls.from_source_parallel(source_code, workers, chunk_size)
+        stream = cls(max_offset=len(source_code))
+        stream.scan(source_code)
+        return stream
+
+    @classmethod
+    def from_source_parallel(cls, source_code, workers, chunk_size):
+        """
+        Tokenize source_code in chunks of about chunk_size characters with a
+        pool of workers processes, then concatenate the token arrays in order
+        """
+        boundaries = split_source(source_code, max(2, len(source_code) // chunk_size))
+        chunks = []
+        offsets = []
+        lines = []
+        line_starts = []
+        line = 1
+        start = 0
+        for end in boundaries + [len(source_code)]:
+            chunks.append(source_code[start:end])
+            offsets.append(start)
+            lines.append(line)
+            line_starts.append(source_code.rfind('\n', 0, start) + 1)
+            line += source_code.count('\n', start, end)
+            start = end
+
+        stream = cls(max_offset=len(source_code))
+        with ProcessPoolExecutor(workers) as executor:
+            for part in executor.map(tokenize_chunk, chunks, offsets, lines, line_starts,
+                                     [len(source_code)] * len(chunks)):
+                stream.extend(part)
+        return stream
+
+    def scan(self, source_code, offset=0, line=1, line_start=0):
+        """
+        Append the tokens of source_code, which starts at offset and line in
+        the whole source code. line_start is the offset in the whole source
+        code of the first character of that line.
+        """
+        append = self.append
+        for match in Lexer.re_master.finditer(source_code):
+            token_type = match.lastgroup
+            start = match.start()
+            end = match.end()
+            if token_type == 'unterminated_comment':
+                self.errors.append(Lexer.unterminated_comment_error(line, offset + start - line_start + 1))
+                break
+            if token_type == 'comment' or token_type == 'whitespace':
+                newlines = source_code.count('\n', start, end)
+                if newlines:
+                    line += newlines
+                    line_start = offset + source_code.rfind('\n', start, end) + 1
+                continue
+            append(token_type, match.group(), offset + start, end - start, line,
+                   offset + start - line_start + 1)
+
+    @classmethod
+    def from_tokens(cls, tokens, *, max_offset=0):
+        """
+        Store Token objects in a TokenStream. Tokens without a position are
+        stored at offset 0, line 0, column 0. max_offset is the largest offset
+        of the tokens, such as the size of their source code.
+        """
+        stream = cls(max_offset=max_offset)
+        for token in tokens:
+            stream.append(token.type, token.value, token.offset or 0, len(token.value),
+                          token.line or 0, token.column or 0)
+        return stream
+
+    def lexeme_id(self, value):
+        """Return the index of value in the lexeme table, adding it if needed"""
+        lexeme_id = self.lexeme_index.get(value)
+        if lexeme_id is None:
+            lexeme_id = len(self.lexemes)
+            self.lexemes.append(sys.intern(value))
+            self.lexeme_index[value] = lexeme_id
+        return lexeme_id
+
+    def append(self, token_type, lexeme, start, length, line, column):
+        """Append a token to the end of the stream"""
+        lexeme_id = self.lexeme_id(lexeme.lower())
+        self.type_codes.append(TOKEN_TYPE_CODES[token_type])
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.lines.append(line)
+        self.columns.append(column)
+        self.lexeme_ids.append(lexeme_id)
+
+    def extend(self, stream):
+        """
+        Append the tokens and errors of another TokenStream, which must have
+        been created with the same max_offset
+        """
+        # Lexeme ids are indexes in the other stream's lexeme table
+        remap = [self.lexeme_id(value) for value in stream.lexemes]
+        self.type_codes.extend(stream.type_codes)
+        self.starts.extend(stream.starts)
+        self.lengths.extend(stream.lengths)
+        self.lines.extend(stream.lines)
+        self.columns.extend(stream.columns)
+        self.lexeme_ids.extend(array('I', map(remap.__getitem__, stream.lexeme_ids)))
+        self.errors.extend(stream.errors)
+
+    def __len__(self):
+        return len(self.type_codes)
+
+    def __getitem__(self, idx):
+        """Return the token at idx as a Token object"""
+        return Token(TOKEN_TYPES[self.type_codes[idx]], self.lexemes[self.lexeme_ids[idx]],
+                     self.lines[idx], self.columns[idx], self.starts[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def to_list(self):
+        """
+        Return the tokens as a list of Token objects, creating each Token once.
+        Use it when every token will be read, possibly more than once, such as
+        by the parser.
+        """
+        lexemes = self.lexemes
+        return list(map(Token, map(TOKEN_TYPES.__getitem__, self.type_codes),
+                        map(lexemes.__getitem__, self.lexeme_ids),
+                        self.lines, self.columns, self.starts))
+
+    @property
+    def tokens(self):
+        """Sequence of tokens, for code that indexes lexer.tokens"""
+        return self
+
+    def token_type(self, idx):
+        """Return the type of the token at idx without creating a Token"""
+        return TOKEN_TYPES[self.type_codes[idx]]
+
+    def token_value(self, idx):
+        """Return the value of the token at idx without creating a Token"""
+        return self.lexemes[self.lexeme_ids[idx]]
+
+    def get_next_token(self):
+        """
+        Return the token at curr_token position and increment curr_token.
+        Return None once all tokens have been returned.
+        """
+        if self.curr_token >= len(self.type_codes):
+            return None
+        next_token = self[self.curr_token]
+        self.curr_token += 1
+        return next_token
+
+    def peek_next_token(self, offset=0):
+        """Return the token offset positions after the next token, or None"""
+        if self.curr_token + offset >= len(self.type_codes):
+            return None
+        return self[self.curr_token + offset]
+
+    def backtrack(self):
+        """Backtrack one position"""
+        if self.curr_token == 0:
+            return
+        self.curr_token -= 1
+
+    def get_prev_token(self):
+        """Return the previous token"""
+        idx = self.curr_token - 1
+        if self.curr_token == 0:
+            idx = 0
+        return self[idx]
+
+    def get_next_token_val(self):
+        """Return the value of the next token"""
+        if self.curr_token >= len(self.type_codes):
+            return ''
+        return self.token_value(self.curr_token)
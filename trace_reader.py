@@ -0,0 +1,39 @@
+"""
+Render a structured production trace, saved with --save-productions-format
+jsonl or bin, back to the text trace.
+Usage: python trace_reader.py [-h] [--positions] [-o OUTPUT] trace file
+"""
+import argparse
+import sys
+
+from trace_writer import read_trace
+
+def render_trace(records, positions=False):
+    """
+    Return the text lines of the trace records read by read_trace.
+    With positions, each line starts with the token index and depth of its record.
+    """
+    if positions:
+        return [f"{token_index:>8} {depth:>4} {text}" for _, text, token_index, depth in records]
+    return [text for _, text, _, _ in records]
+
+def main(trace_filename, output_filename=None, positions=False):
+    with open(trace_filename, 'rb') as trace_file:
+        lines = render_trace(read_trace(trace_file), positions)
+    text = ''.join(line + '\n' for line in lines)
+    if output_filename:
+        with open(output_filename, 'w') as out_file:
+            out_file.write(text)
+    else:
+        sys.stdout.write(text)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('trace_file', metavar='trace file',
+                            help="Structured trace saved by the compiler")
+    arg_parser.add_argument('--positions', action='store_true', default=False,
+                            help="Start each line with the token index and depth of its record")
+    arg_parser.add_argument('-o', '--output', action='store', default=None,
+                            help="Save the text trace to a file instead of printing it")
+    args = arg_parser.parse_args()
+    main(args.trace_file, args.output, args.positions)
@@ -0,0 +1,251 @@
+"""Buffered sinks for the production trace printed and saved by the parser"""
+import json
+import struct
+import sys
+
+from parse_token import Token
+
+# Kinds of records in a structured trace. TEXT records define the text of
+# the other records, which refer to it by id.
+PRODUCTION = 0
+TOKEN = 1
+ERROR = 2
+TEXT = 3
+RECORD_KINDS = ('production', 'token', 'error', 'text')
+# Binary trace files start with the magic and version, followed by records
+TRACE_FILE_MAGIC = b'R24TRACE'
+# Increase when the layout of binary trace files changes
+TRACE_FILE_VERSION = 1
+TRACE_FILE_HEADER = struct.Struct('<8sH')
+# Kind, text id, token index, and depth
+TRACE_RECORD = struct.Struct('<BIII')
+# TEXT, text id, and the length of the UTF-8 encoded text that follows
+TRACE_TEXT = struct.Struct('<BII')
+
+def format_trace_line(line):
+    """Return the text of a trace line, which is a string or a Token"""
+    if line.__class__ is Token:
+        return f"Token: {line.type:15} Lexeme: {line.value}"
+    return line
+
+class TraceWriter:
+    """
+    Prints and writes to a file the lines of a production trace.
+    Lines are kept in a buffer and written flush_lines at a time through
+    one file handle, which stays open until close is called. Tokens can be
+    written as Token objects, which are only formatted when the buffer is
+    flushed.
+    """
+    # Default number of lines buffered before they are written
+    flush_lines = 4096
+    # True if lines are written as (line, depth) tuples, where depth is the
+    # number of statements the line is in
+    records_depth = False
+    # Output file, None until it is opened and after it is closed
+    out_file = None
+
+    def __init__(self, *, print_to_console=False, out_filename=None, flush_lines=None):
+        self.print_to_console = print_to_console
+        self.out_filename = out_filename
+        if flush_lines is not None:
+            self.flush_lines = flush_lines
+        self.lines = []
+        if out_filename:
+            # Opening the file also clears it
+            self.out_file = open(out_filename, 'w')
+
+    @classmethod
+    def open(cls, *, print_to_console=False, out_filename=None, flush_lines=None):
+        """Return a TraceWriter, or None if the trace is neither printed nor saved to a file"""
+        if not (print_to_console or out_filename):
+            return None
+        return cls(print_to_console=print_to_console, out_filename=out_filename, flush_lines=flush_lines)
+
+    def write(self, line):
+        """Add a line, a string or a Token, to the trace"""
+        lines = self.lines
+        lines.append(line)
+        if len(lines) >= self.flush_lines:
+            self.flush()
+
+    def flush(self):
+        """Print and write to the file the buffered lines"""
+        if not self.lines:
+            return
+        text = '\n'.join([format_trace_line(line) for line in self.lines]) + '\n'
+        self.lines.clear()
+        if self.print_to_console:
+            sys.stdout.write(text)
+        if self.out_file is not None:
+            self.out_file.write(text)
+            self.out_file.flush()
+
+    def close(self):
+        """Flush the buffered lines and close the file"""
+        self.flush()
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+
+    def __del__(self):
+        # Lines written after the last flush are not lost if close is not called
+        if self.out_file is not None:
+            self.close()
+
+def nonterminal(text):
+    """Return the name of the nonterminal on the left-hand side of a production line"""
+    text = text.lstrip()
+    if not text.startswith('<'):
+        return None
+    return text[1:text.find('>')]
+
+class StructuredTraceWriter(TraceWriter):
+    """
+    Saves the production trace as records instead of lines of text, in
+    JSON Lines ('jsonl') or binary ('bin') format. Each production, token,
+    and error record has its kind, the id of its text, the number of tokens
+    in the trace before it, and its depth: [kind, id, token index, depth]
+    in JSON Lines. The text of each id is defined by a TEXT record,
+    [TEXT, id, text] in JSON Lines, before the first record using it, so
+    repeated productions and tokens only take a few bytes.
+    Records can be filtered by kind (a set of 'production', 'token', and
+    'error') and by the nonterminals of productions (a set of names such as
+    'Statement'), and only 1 in sample of the records left is kept. Errors
+    are never left out by sampling. The console output is not filtered.
+    trace_reader.py renders the records back to the text trace.
+    """
+    records_depth = True
+
+    def __init__(self, out_filename, format='jsonl', *, kinds=None, nonterminals=None,
+                 sample=1, print_to_console=False, flush_lines=None):
+        if format not in ('jsonl', 'bin'):
+            raise ValueError(f"Trace format {format} is not a valid format.")
+        self.format = format
+        self.kinds = None
+        if kinds is not None:
+            for kind in kinds:
+                if kind not in RECORD_KINDS[:TEXT]:
+                    raise ValueError(f"Trace record kind {kind} is not a valid kind.")
+            self.kinds = {RECORD_KINDS.index(kind) for kind in kinds}
+        self.nonterminals = None if nonterminals is None else set(nonterminals)
+        if sample < 1:
+            raise ValueError("Trace sample must be at least 1.")
+        self.sample = sample
+        # Records that passed the filters, used for sampling
+        self.record_count = 0
+        # Tokens in the trace so far
+        self.token_count = 0
+        # Id of the text of each line, by line or by token kind and value,
+        # and whether productions with the line pass the nonterminals filter
+        self.text_ids = {}
+        self.kept_productions = {}
+        super().__init__(print_to_console=print_to_console, out_filename=None, flush_lines=flush_lines)
+        self.out_filename = out_filename
+        if format == 'bin':
+            self.out_file = open(out_filename, 'wb')
+            self.out_file.write(TRACE_FILE_HEADER.pack(TRACE_FILE_MAGIC, TRACE_FILE_VERSION))
+        else:
+            self.out_file = open(out_filename, 'w', encoding='utf-8')
+
+    def add_text(self, key, line, records):
+        """Give the text of line an id, adding its TEXT record to records, and return the id"""
+        text = format_trace_line(line)
+        text_id = self.text_ids[key] = len(self.text_ids)
+        if self.format == 'bin':
+            encoded = text.encode('utf-8')
+            records.append(TRACE_TEXT.pack(TEXT, text_id, len(encoded)) + encoded)
+        else:
+            records.append(f"[{TEXT},{text_id},{json.dumps(text)}]\n")
+        return text_id
+
+    def flush(self):
+        """
+        Print the buffered lines, and write the records of the lines that
+        pass the filters to the file. Lines are (line, depth) tuples, where
+        line is a string or a Token.
+        """
+        if not self.lines:
+            return
+        if self.print_to_console:
+            sys.stdout.write('\n'.join([format_trace_line(line) for line, _ in self.lines]) + '\n')
+        records = []
+        text_ids = self.text_ids
+        kinds = self.kinds
+        nonterminals = self.nonterminals
+        kept_productions = self.kept_productions
+        sample = self.sample
+        is_binary = self.format == 'bin'
+        pack_record = TRACE_RECORD.pack
+        for line, depth in self.lines:
+            if line.__class__ is Token:
+                kind = TOKEN
+                token_index = self.token_count
+                self.token_count += 1
+                # Tokens are looked up by kind and value so they are only
+                # formatted the first time
+                key = (line.kind, line.value)
+            else:
+                kind = ERROR if line.startswith('  Error') else PRODUCTION
+                token_index = self.token_count
+                key = line
+            if kinds is not None and kind not in kinds:
+                continue
+            if kind == PRODUCTION and nonterminals is not None:
+                is_kept = kept_productions.get(line)
+                if is_kept is None:
+                    is_kept = kept_productions[line] = nonterminal(line) in nonterminals
+                if not is_kept:
+                    continue
+            if kind != ERROR and sample > 1:
+                self.record_count += 1
+                if self.record_count % sample:
+                    continue
+            text_id = text_ids.get(key)
+            if text_id is None:
+                text_id = self.add_text(key, line, records)
+            if is_binary:
+                records.append(pack_record(kind, text_id, token_index, depth))
+            else:
+                records.append(f"[{kind},{text_id},{token_index},{depth}]\n")
+        self.lines.clear()
+        if records and self.out_file is not None:
+            self.out_file.write((b'' if is_binary else '').join(records))
+            self.out_file.flush()
+
+def read_trace(trace_file):
+    """
+    Yield the records of a structured trace read from the binary file
+    object trace_file, as (kind, text, token index, depth) tuples where
+    kind is 'production', 'token', or 'error'.
+    Raises ValueError if trace_file is not a structured trace.
+    """
+    data = trace_file.read()
+    texts = []
+    if data.startswith(TRACE_FILE_MAGIC):
+        magic, version = TRACE_FILE_HEADER.unpack_from(data)
+        if version != TRACE_FILE_VERSION:
+            raise ValueError(f"Trace file version {version} is not supported.")
+        pos = TRACE_FILE_HEADER.size
+        while pos < len(data):
+            if data[pos] == TEXT:
+                _, text_id, length = TRACE_TEXT.unpack_from(data, pos)
+                pos += TRACE_TEXT.size
+                texts.append(data[pos:pos + length].decode('utf-8'))
+                pos += length
+                continue
+            if pos + TRACE_RECORD.size > len(data):
+                raise ValueError("Trace file is truncated.")
+            kind, text_id, token_index, depth = TRACE_RECORD.unpack_from(data, pos)
+            pos += TRACE_RECORD.size
+            yield RECORD_KINDS[kind], texts[text_id], token_index, depth
+        return
+    for line in data.decode('utf-8').splitlines():
+        try:
+            record = json.loads(line)
+            if record[0] == TEXT:
+                texts.append(record[2])
+                continue
+            kind, text_id, token_index, depth = record
+            yield RECORD_KINDS[kind], texts[text_id], token_index, depth
+        except (ValueError, TypeError, KeyError, IndexError):
+            raise ValueError("File is not a structured trace.") from None
@@ -1,15 +1,32 @@
 """Utility functions used in compiler"""
 import argparse
+import os
 from pathlib import Path
 
+# Directory of the token cache used when --cache-dir is not given
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rat24s')
+
 def print_source_code(sourceCode):
     """Print the source code used by the compiler"""
     print('='*32, " Source Code ", '='*33)
     print(sourceCode)
     print('='*80, '\n')
+
+def positive_int(value):
+    """Return value as an integer, raising ArgumentTypeError if it is not at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: '{value}'")
+    return number
     
-def parse_arguments():
-    """Parse command-line arguments using argparse and return arguments"""
+def parse_arguments(args=None):
+    """
+    Parse command-line arguments using argparse and return arguments.
+    args are the arguments to parse, sys.argv[1:] if None.
+    """
     arg_parser = argparse.ArgumentParser()
 
     # Path to source code file arg
@@ -22,12 +39,28 @@ def parse_arguments():
     # Arg to specify output file (optional)
     arg_parser.add_argument('--save-tokens', action='store', default=None,
                     help="Specify output file for tokens")
+    # Arg to choose the format of the tokens output file
+    arg_parser.add_argument('--save-tokens-format', action='store', default='text',
+                    choices=['text', 'bin'], help="Format of the tokens output file")
     # Arg to print proudctions to console
     arg_parser.add_argument('--print-productions', action='store_true',
                             default=False, help='Print productions to console')
     # Arg to save RDP productions to file
     arg_parser.add_argument('-s', '--save-productions', action='store',
                             default=None, help="Save syntax analyzer productions to a file")
+    # Args to save the productions as a structured trace, filtered and sampled
+    arg_parser.add_argument('--save-productions-format', action='store', default='text',
+                            choices=['text', 'jsonl', 'bin'],
+                            help="Format of the productions output file. jsonl and bin save a structured trace "
+                                 "that can be rendered as text with trace_reader.py")
+    arg_parser.add_argument('--trace-kinds', action='append', default=None,
+                            choices=['production', 'token', 'error'],
+                            help="Kind of records kept in a structured trace. Repeat to keep more than one kind")
+    arg_parser.add_argument('--trace-nonterminals', action='store', default=None,
+                            help="Comma separated nonterminals whose productions are kept in a structured trace, "
+                                 "such as Statement,Assign")
+    arg_parser.add_argument('--trace-sample', action='store', type=positive_int, default=1,
+                            help="Keep 1 in TRACE_SAMPLE records of a structured trace. Errors are always kept")
     # ARg to save symbol table to a file
     arg_parser.add_argument('--symbol-table', action='store',
                             default=None, help="Save symbol table to a file")
@@ -36,13 +69,28 @@ def parse_arguments():
     arg_parser.add_argument('-o', '--output', action='store',
                             default=None, help="Save assembly code and symbol table to output file")
 
+    # Args to choose the token cache directory or to not use the token cache
+    arg_parser.add_argument('--cache-dir', action='store', default=DEFAULT_CACHE_DIR,
+                            help="Directory where tokens are cached between compilations")
+    arg_parser.add_argument('--no-cache', action='store_true', default=False,
+                            help="Tokenize the source code without using the token cache")
+
     # Parse command-line arguments
-    path = Path(arg_parser.parse_args().source_code)
-    print_tokens = arg_parser.parse_args().print_tokens
-    tokens_filename = arg_parser.parse_args().save_tokens
-    print_prods = arg_parser.parse_args().print_productions
-    prods_filename = arg_parser.parse_args().save_productions
-    sym_table_filename = arg_parser.parse_args().symbol_table
-    asm_filename = arg_parser.parse_args().output
-
-    return path, print_tokens, tokens_filename, print_prods, prods_filename, sym_table_filename, asm_filename, arg_parser.print_help
\ No newline at end of file
+    path = Path(arg_parser.parse_args(args).source_code)
+    print_tokens = arg_parser.parse_args(args).print_tokens
+    tokens_filename = arg_parser.parse_args(args).save_tokens
+    print_prods = arg_parser.parse_args(args).print_productions
+    prods_filename = arg_parser.parse_args(args).save_productions
+    sym_table_filename = arg_parser.parse_args(args).symbol_table
+    asm_filename = arg_parser.parse_args(args).output
+    cache_dir = None if arg_parser.parse_args(args).no_cache else arg_parser.parse_args(args).cache_dir
+    tokens_format = arg_parser.parse_args(args).save_tokens_format
+    prods_format = arg_parser.parse_args(args).save_productions_format
+    trace_kinds = arg_parser.parse_args(args).trace_kinds
+    trace_nonterminals = arg_parser.parse_args(args).trace_nonterminals
+    trace_nonterminals = trace_nonterminals.split(',') if trace_nonterminals else None
+    trace_sample = arg_parser.parse_args(args).trace_sample
+
+    return (path, print_tokens, tokens_filename, print_prods, prods_filename, sym_table_filename, asm_filename,
+            arg_parser.print_help, cache_dir, tokens_format, prods_format, trace_kinds, trace_nonterminals,
+            trace_sample)
\ No newline at end of file